@@ -0,0 +1,52 @@
+"""empty message
+
+Revision ID: a3d58e17c6f2
+Revises: 6c1e9a3f05d8
+Create Date: 2026-10-18 16:24:51.087342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d58e17c6f2'
+down_revision = '6c1e9a3f05d8'
+branch_labels = None
+depends_on = None
+
+# name, table, columns, options
+indexes = (
+    ('idx_battle_net_info_replay_association_replay_id',
+        'battle_net_info_replay_association', ['replay_id'], {}),
+    ('idx_replays_start_time', 'replays', ['start_time'], {}),
+    ('idx_replays_region_start_time',
+        'replays', ['region', 'start_time'], {}),
+    ('idx_replays_map_id_start_time',
+        'replays', ['map_id', 'start_time'], {}),
+    ('idx_replays_winner_id', 'replays', ['winner_id'], {}),
+    ('idx_replays_versions',
+        'replays', ['versions'], { 'postgresql_using': 'gin' }),
+    ('idx_battle_net_info_ladder_id', 'battle_net_info', ['ladder_id'], {}),
+)
+
+
+def upgrade():
+    # built concurrently so imports can keep writing meanwhile, which
+    # can't happen inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in indexes:
+            op.create_index(
+                name, table, columns,
+                unique=False,
+                postgresql_concurrently=True,
+                **options)
+        op.execute('ANALYZE replays')
+        op.execute('ANALYZE battle_net_info_replay_association')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(indexes):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True)
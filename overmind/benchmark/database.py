@@ -0,0 +1,83 @@
+from overmind import metrics
+from overmind.database import (
+    unit_of_work, get_engine,
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT)
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+import threading
+import time
+import os
+
+# more threads than the pool has connections, so units queue for them
+BENCHMARK_THREADS = int(os.environ.get(
+    'BENCHMARK_THREADS', 2 * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW)))
+BENCHMARK_UNITS = int(os.environ.get('BENCHMARK_UNITS', 50))
+# seconds each unit of work holds its connection, standing in for a batch
+BENCHMARK_HOLD = float(os.environ.get('BENCHMARK_HOLD', 0.01))
+
+# pool checkouts by the current thread's unit of work
+_checkouts = threading.local()
+
+def _count_checkout(*args):
+    _checkouts.count += 1
+
+# (pool timeouts, units that checked out other than one connection)
+def _units(units, hold):
+    timeouts = 0
+    miscounted = 0
+    for _ in range(units):
+        _checkouts.count = 0
+        try:
+            with unit_of_work() as session:
+                with metrics.timer('checkout'):
+                    session.connection()
+                with metrics.timer('query'):
+                    session.execute('SELECT 1').scalar()
+                    with unit_of_work() as nested:
+                        nested.execute('SELECT 2').scalar()
+                time.sleep(hold)
+        except PoolTimeoutError:
+            timeouts += 1
+            continue
+        if _checkouts.count != 1:
+            miscounted += 1
+    return timeouts, miscounted
+
+def check_pool(
+    threads=BENCHMARK_THREADS, units=BENCHMARK_UNITS, hold=BENCHMARK_HOLD):
+    event.listen(get_engine().pool, 'checkout', _count_checkout)
+    try:
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(
+                _units, [ units ] * threads, [ hold ] * threads))
+    finally:
+        event.remove(get_engine().pool, 'checkout', _count_checkout)
+    return tuple(map(sum, zip(*results)))
+
+# many threads sharing the pool, each unit of work checking out exactly one
+# connection. fails on any pool timeout or a unit that checked out other
+# than one connection. with no DATABASE_CONNECTION_STRING it runs against
+# a scratch sqlite file through the same pool settings.
+def main(threads=BENCHMARK_THREADS, units=BENCHMARK_UNITS, hold=BENCHMARK_HOLD):
+    with TemporaryDirectory() as directory:
+        os.environ.setdefault(
+            'DATABASE_CONNECTION_STRING',
+            f'sqlite:///{os.path.join(directory, "pool.sqlite")}')
+        metrics.reset()
+        start = time.perf_counter()
+        timeouts, miscounted = check_pool(threads, units, hold)
+        elapsed = time.perf_counter() - start
+        print(f'{threads} threads    {threads * units} units    '
+            f'pool {DATABASE_POOL_SIZE}+{DATABASE_MAX_OVERFLOW}    '
+            f'timeout {DATABASE_POOL_TIMEOUT}s')
+        print(metrics.format_summary(metrics.summary(elapsed=elapsed)))
+        print(f'{get_engine().pool.status()}')
+        print(f'{timeouts} pool timeouts    {miscounted} units not on one '
+            f'connection    {elapsed:.2f}s')
+        get_engine().dispose()
+    return 1 if timeouts or miscounted else 0
+
+if __name__ == '__main__':
+    exit(main())
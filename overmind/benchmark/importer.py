@@ -0,0 +1,154 @@
+from overmind import metrics, bnet_api, replay_loader
+from overmind import replay_importer
+from overmind.bnet_api.stub import StubServer
+from overmind.replay_importer.store import ReplayStore
+from overmind.replay_importer import pipeline
+from pathlib import Path
+import subprocess
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+import re
+import dotenv
+
+dotenv.load_dotenv()
+
+# a scratch database with the migrations applied; never defaults to
+# DATABASE_CONNECTION_STRING so a benchmark can't write to the real one
+BENCHMARK_DATABASE = os.environ.get('BENCHMARK_DATABASE')
+BENCHMARK_CORPUS = os.environ.get('BENCHMARK_CORPUS')
+BENCHMARK_COPIES = int(os.environ.get('BENCHMARK_COPIES', 20))
+BENCHMARK_WORKERS = int(os.environ.get('BENCHMARK_WORKERS', os.cpu_count()))
+BENCHMARK_BATCH_SIZE = int(os.environ.get('BENCHMARK_BATCH_SIZE', 100))
+BENCHMARK_BNET_LATENCY = float(os.environ.get('BENCHMARK_BNET_LATENCY', 0.05))
+BENCHMARK_PIPELINE = bool(int(os.environ.get('BENCHMARK_PIPELINE', 1)))
+BENCHMARK_RESULTS_PATH = os.environ.get(
+    'BENCHMARK_RESULTS_PATH', 'benchmark_results')
+
+_label_re = re.compile(r'[^0-9A-Za-z]')
+
+def _label(name):
+    return _label_re.sub('', name) or 'unknown'
+
+# copies of each seed replay under "<player> vs <player>" directories, so
+# path labels match. a trailer after the archive makes every copy hash
+# differently without changing what sc2reader reads.
+def build_corpus(seed_paths, root, copies=BENCHMARK_COPIES):
+    root = Path(root)
+    for i, seed in enumerate(map(Path, seed_paths)):
+        replay = replay_loader.load_replay(str(seed), 'import')
+        directory = root / f'{i:04}' / ' vs '.join(
+            _label(player.name) for player in replay.players[:2] )
+        directory.mkdir(parents=True, exist_ok=True)
+        data = seed.read_bytes()
+        for copy in range(copies):
+            (directory / f'game_{copy}.SC2Replay').write_bytes(
+                data + f'overmind-benchmark-{i}-{copy}'.encode())
+    return root
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ( 'git', 'rev-parse', '--short', 'HEAD' ),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(corpus, workers, batch_size, server):
+    replay_importer.load_player_alias_map(
+        replay_importer.PLAYER_ALIAS_MAP_PATH)
+    replay_importer.load_replay_file_hashes()
+    replay_importer.load_resolver()
+    store = tempfile.mkdtemp(prefix='overmind-store-')
+    replay_importer._replay_store = ReplayStore(Path(store))
+    metrics.reset()
+    start = time.perf_counter()
+    paths = list()
+    mark = time.perf_counter()
+    for path in replay_importer.walk_paths(corpus):
+        now = time.perf_counter()
+        metrics.record('discovery', now - mark)
+        mark = now
+        paths.append(path)
+    statuses = dict()
+    results = pipeline.import_paths(
+        enumerate(paths), workers, batch_size,
+        client_options={
+            'client_id': 'benchmark',
+            'client_secret': 'benchmark',
+            'api_url': server.url,
+            'token_url': server.token_url }) \
+        if BENCHMARK_PIPELINE \
+        else replay_importer.import_paths(
+            enumerate(paths), workers, batch_size)
+    for _, exception, _, (_, copy_path) in results:
+        status = 'imported' if copy_path \
+            else getattr(exception, 'reason', None) \
+            or type(exception).__name__
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(store, ignore_errors=True)
+    return elapsed, len(paths), statuses
+
+def main(seed_paths=()):
+    if not BENCHMARK_DATABASE:
+        print('set BENCHMARK_DATABASE to a scratch database')
+        return 1
+    os.environ['DATABASE_CONNECTION_STRING'] = BENCHMARK_DATABASE
+    # the stub only speaks plain http
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+    corpus = tempfile.mkdtemp(prefix='overmind-corpus-') \
+        if seed_paths \
+        else BENCHMARK_CORPUS
+    if not corpus:
+        print('usage: python -m overmind.benchmark.importer [SEED_REPLAY...]'
+            '\n  without seeds, BENCHMARK_CORPUS names an existing corpus')
+        return 1
+    if seed_paths:
+        build_corpus(seed_paths, corpus)
+    cache = tempfile.mkdtemp(prefix='overmind-bnet-cache-')
+    bnet_api.cache.BNET_CACHE_PATH = os.path.join(cache, 'cache.sqlite')
+    with StubServer(latency=BENCHMARK_BNET_LATENCY) as server:
+        bnet_api.BASE_URL_FORMAT = \
+            server.url + '/sc2/profile/{}/{}/{}{}?access_token={}'
+        bnet_api.TOKEN_URL = server.token_url
+        elapsed, replays, statuses = run(
+            corpus, BENCHMARK_WORKERS, BENCHMARK_BATCH_SIZE, server)
+        bnet_requests = server.requests
+    shutil.rmtree(cache, ignore_errors=True)
+    if seed_paths:
+        shutil.rmtree(corpus, ignore_errors=True)
+    summary = metrics.summary(elapsed=elapsed)
+    results = {
+        'revision': git_revision(),
+        'time': time.time(),
+        'replays': replays,
+        'elapsed': elapsed,
+        'replays_per_second': replays / elapsed if elapsed else None,
+        'statuses': statuses,
+        'bnet_requests': bnet_requests,
+        'counters': metrics.counters(),
+        'settings': {
+            'workers': BENCHMARK_WORKERS,
+            'batch_size': BENCHMARK_BATCH_SIZE,
+            'pipeline': BENCHMARK_PIPELINE,
+            'bnet_latency': BENCHMARK_BNET_LATENCY,
+            'copies': BENCHMARK_COPIES if seed_paths else None },
+        'stages': summary }
+    os.makedirs(BENCHMARK_RESULTS_PATH, exist_ok=True)
+    results_path = os.path.join(
+        BENCHMARK_RESULTS_PATH,
+        f'importer-{results["revision"] or "unknown"}-{int(time.time())}.json')
+    with open(results_path, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(metrics.format_summary(summary))
+    print(f'{replays} replays    {elapsed:.2f}s    '
+        f'{results["replays_per_second"]:.1f}/s    {statuses}')
+    print(results_path)
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+from overmind.database.models import (
+    Base, Replay, BattleNetInfo, BattleNetInfoReplayAssociation)
+from overmind.benchmark.importer import (
+    git_revision, BENCHMARK_DATABASE, BENCHMARK_RESULTS_PATH)
+from sqlalchemy import create_engine, text
+import numpy as np
+import json
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+BENCHMARK_REPLAYS = int(os.environ.get('BENCHMARK_REPLAYS', 100000))
+BENCHMARK_PLAYERS = int(os.environ.get('BENCHMARK_PLAYERS', 5000))
+BENCHMARK_MAPS = int(os.environ.get('BENCHMARK_MAPS', 20))
+BENCHMARK_RUNS = int(os.environ.get('BENCHMARK_RUNS', 5))
+# tables are built here, away from anything the migrations created
+BENCHMARK_SCHEMA = 'overmind_query_benchmark'
+
+# the analytic indexes, dropped for the before half of the run
+INDEXES = tuple(
+    index
+    for table in (
+        Replay.__table__,
+        BattleNetInfo.__table__,
+        BattleNetInfoReplayAssociation.__table__)
+    for index in table.indexes
+    if index.name in (
+        'idx_battle_net_info_replay_association_replay_id',
+        'idx_replays_start_time',
+        'idx_replays_region_start_time',
+        'idx_replays_map_id_start_time',
+        'idx_replays_winner_id',
+        'idx_replays_versions',
+        'idx_battle_net_info_ladder_id') )
+
+# the shapes of query stats.txt is built from
+QUERIES = {
+    'start_time_range':
+        "SELECT count(*) FROM replays "
+        "WHERE start_time >= '2016-03-01' AND start_time < '2016-04-01'",
+    'region_start_time':
+        "SELECT count(*) FROM replays "
+        "WHERE region = 'eu' "
+        "AND start_time >= '2016-03-01' AND start_time < '2016-06-01'",
+    'map_start_time':
+        "SELECT count(*) FROM replays "
+        "WHERE map_id = 3 AND start_time >= '2017-01-01'",
+    'winner':
+        "SELECT id, start_time FROM replays WHERE winner_id = 42",
+    'base_build':
+        "SELECT count(*) FROM replays WHERE versions @> ARRAY[40007]",
+    'replay_players':
+        "SELECT a.battle_net_info_id, a.race "
+        "FROM replays r "
+        "JOIN battle_net_info_replay_association a ON a.replay_id = r.id "
+        "WHERE r.start_time >= '2016-03-01' AND r.start_time < '2016-03-08'",
+    'ladder_members':
+        "SELECT id FROM battle_net_info WHERE ladder_id = 200010",
+}
+
+# replays written in no particular start_time order, as the importer's
+# parallel walk writes them. every replay has two players and a winner
+# among the players.
+SYNTHETIC_DATA = (
+    "INSERT INTO maps (id, file_hash, map_name, width, height, tile_set, "
+    "camera_top, camera_left, camera_bottom, camera_right) "
+    "SELECT g, decode(md5(g::text), 'hex'), 'map ' || g, 128, 128, "
+    "'tiles', 0, 0, 128, 128 "
+    "FROM generate_series(1, :maps) g",
+    "INSERT INTO battle_net_info (id, profile_id, region, realm, ladder_id) "
+    "SELECT g, g, 1 + g % 3, 1, 200000 + g / 100 "
+    "FROM generate_series(1, :players) g",
+    "INSERT INTO replays (id, file_hash, original_path, versions, category, "
+    "map_id, start_time, end_time, real_length, expansion, frames, game_fps, "
+    "real_type, is_ladder, is_private, speed, region, winner_id) "
+    "SELECT g, decode(md5(g::text), 'hex'), NULL, "
+    "ARRAY[2, 5, g * 40 / :replays, 0, 40000 + g * 40 / :replays], "
+    "'Ladder', 1 + g % :maps, start_time, start_time + interval '15 min', "
+    "interval '15 min', 'LotV', 20160, 16.0, '1v1', true, false, "
+    "'Faster', (ARRAY['us', 'eu', 'kr', 'cn'])[1 + g % 4], "
+    "1 + (g * 7) % :players "
+    "FROM generate_series(1, :replays) g, LATERAL (SELECT "
+    "timestamp '2013-01-01' + g * interval '30 min' "
+    "+ random() * interval '2 days' AS start_time) t "
+    "ORDER BY random()",
+    "INSERT INTO battle_net_info_replay_association "
+    "(battle_net_info_id, replay_id, race) "
+    "SELECT 1 + (g * 7) % :players, g, "
+    "((ARRAY['PROTOSS', 'TERRAN', 'ZERG'])[1 + g % 3])::race "
+    "FROM generate_series(1, :replays) g "
+    "UNION ALL "
+    "SELECT 1 + ((g * 7) % :players + 1 + g % (:players - 2)) % :players, "
+    "g, "
+    "((ARRAY['PROTOSS', 'TERRAN', 'ZERG'])[1 + g / 3 % 3])::race "
+    "FROM generate_series(1, :replays) g",
+)
+
+def build(connection):
+    connection.execute(
+        text(f'DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE'))
+    connection.execute(text(f'CREATE SCHEMA {BENCHMARK_SCHEMA}'))
+    connection.execute(text(f'SET search_path TO {BENCHMARK_SCHEMA}'))
+    # the schema was just created, there is nothing to check for
+    Base.metadata.create_all(connection, checkfirst=False)
+    for index in INDEXES:
+        index.drop(connection)
+    parameters = {
+        'replays': BENCHMARK_REPLAYS,
+        'players': BENCHMARK_PLAYERS,
+        'maps': BENCHMARK_MAPS }
+    for statement in SYNTHETIC_DATA:
+        connection.execute(text(statement), parameters)
+    connection.execute(text('ANALYZE'))
+
+def _plan_nodes(plan):
+    yield plan['Node Type'] \
+        + (f' using {plan["Index Name"]}' if 'Index Name' in plan else '')
+    for child in plan.get('Plans', ()):
+        yield from _plan_nodes(child)
+
+def measure(connection, runs=BENCHMARK_RUNS):
+    results = dict()
+    for name, sql in QUERIES.items():
+        times = list()
+        for _ in range(runs):
+            (plan,), = connection.execute(
+                text(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')).fetchone()
+            times.append(plan['Execution Time'])
+        results[name] = {
+            'median_ms': float(np.median(times)),
+            'plan': list(_plan_nodes(plan['Plan'])) }
+    return results
+
+# plans and timings of each query without the analytic indexes, then with
+# them, on the same synthetic data
+def main():
+    if not BENCHMARK_DATABASE:
+        print('set BENCHMARK_DATABASE to a scratch database')
+        return 1
+    engine = create_engine(BENCHMARK_DATABASE)
+    with engine.connect() as connection:
+        start = time.perf_counter()
+        with connection.begin():
+            build(connection)
+        built = time.perf_counter() - start
+        before = measure(connection)
+        start = time.perf_counter()
+        for index in INDEXES:
+            index.create(connection)
+        connection.execute(text('ANALYZE'))
+        indexed = time.perf_counter() - start
+        after = measure(connection)
+        sizes = { index.name: connection.execute(
+            text('SELECT pg_size_pretty('
+                'pg_relation_size(CAST(:name AS regclass)))'),
+            name=f'{BENCHMARK_SCHEMA}.{index.name}').scalar()
+            for index in INDEXES }
+        connection.execute(
+            text(f'DROP SCHEMA {BENCHMARK_SCHEMA} CASCADE'))
+    engine.dispose()
+    results = {
+        'revision': git_revision(),
+        'time': time.time(),
+        'replays': BENCHMARK_REPLAYS,
+        'build_seconds': built,
+        'index_seconds': indexed,
+        'index_sizes': sizes,
+        'queries': {
+            name: { 'before': before[name], 'after': after[name] }
+            for name in QUERIES } }
+    os.makedirs(BENCHMARK_RESULTS_PATH, exist_ok=True)
+    results_path = os.path.join(
+        BENCHMARK_RESULTS_PATH,
+        f'queries-{results["revision"] or "unknown"}-{int(time.time())}.json')
+    with open(results_path, 'w') as file:
+        json.dump(results, file, indent=4)
+    for name in QUERIES:
+        print(f'{name:<20}'
+            f'{before[name]["median_ms"]:>10.2f}ms'
+            f'{after[name]["median_ms"]:>10.2f}ms    '
+            f'{" > ".join(before[name]["plan"])}  ->  '
+            f'{" > ".join(after[name]["plan"])}')
+    for name, size in sizes.items():
+        print(f'{name:<52}{size}')
+    print(f'{BENCHMARK_REPLAYS} replays    built {built:.1f}s    '
+        f'indexed {indexed:.1f}s')
+    print(results_path)
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
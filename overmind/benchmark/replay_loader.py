@@ -0,0 +1,28 @@
+from overmind.replay_loader import load_replay, LOAD_PROFILES
+import os
+import sys
+import time
+
+BENCHMARK_PROFILES = os.environ.get(
+    'BENCHMARK_PROFILES', 'full,import_stats,import,stats,details,header') \
+    .split(',')
+
+# seconds per replay for each profile over the same files. the first pass
+# only warms the page cache.
+def main(paths=()):
+    if not paths:
+        print('usage: python -m overmind.benchmark.replay_loader REPLAY...')
+        return 1
+    for path in paths:
+        load_replay(path, 'header')
+    for profile in BENCHMARK_PROFILES:
+        start = time.perf_counter()
+        for path in paths:
+            load_replay(path, LOAD_PROFILES[profile])
+        seconds = time.perf_counter() - start
+        print(f'{profile:<16}{len(paths)} replays    {seconds:.3f}s    '
+            f'{seconds / len(paths) * 1000:.1f}ms/replay')
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+from overmind.stats import ReplaySeries, compute_metrics, replay_series
+from overmind.timeseries import (
+    PLAYER_STATS_FIELDS, PLAYER_STATS_FIELD_INDEX,
+    UNIT_EVENT_FIELDS, PLAYER_STATS_DTYPE)
+import numpy as np
+from overmind.replay_loader import load_replay
+import os
+import sys
+import time
+
+BENCHMARK_REPLAYS = int(os.environ.get('BENCHMARK_REPLAYS', 2000))
+BENCHMARK_BATCH_SIZE = int(os.environ.get('BENCHMARK_BATCH_SIZE', 500))
+BENCHMARK_SEED = int(os.environ.get('BENCHMARK_SEED', 0))
+
+# roughly a 15 minute 1v1, one PlayerStatsEvent every 160 frames
+def synthetic_series(rng, samples=90, unit_events=400):
+    samples = int(rng.integers(samples // 2, samples * 2))
+    player_stats = rng.integers(
+        0, 4000, (2, samples, len(PLAYER_STATS_FIELDS))) \
+        .astype(PLAYER_STATS_DTYPE)
+    player_stats[..., PLAYER_STATS_FIELD_INDEX['frame']] = \
+        np.arange(samples) * 160
+    food_made = np.minimum(14 + np.arange(samples) * 4, 200)
+    player_stats[..., PLAYER_STATS_FIELD_INDEX['food_made']] = food_made
+    player_stats[..., PLAYER_STATS_FIELD_INDEX['food_used']] = \
+        food_made - rng.integers(0, 8, (2, samples))
+    events = np.zeros((unit_events, len(UNIT_EVENT_FIELDS)), PLAYER_STATS_DTYPE)
+    events[:, 0] = np.sort(rng.integers(0, samples * 160, unit_events))
+    events[:, 1] = rng.integers(1, 3, unit_events)
+    events[:, 3] = rng.random(unit_events) < 0.4
+    events[:, 2] = np.where(events[:, 3] > 0, 3 - events[:, 1], 0)
+    events[:, 5] = rng.random(unit_events) < 0.3
+    events[:, 6] = events[:, 5] == 0
+    events[:, 4] = np.where(events[:, 5] > 0, 1, rng.integers(1, 7, unit_events))
+    return ReplaySeries(pids=(1, 2), player_stats=player_stats, unit_events=events)
+
+def run(batch, batch_size):
+    start = time.perf_counter()
+    rows = 0
+    for i in range(0, len(batch), batch_size):
+        rows += len(compute_metrics(batch[i:i+batch_size])['replay'])
+    return rows, time.perf_counter() - start
+
+def main(paths=()):
+    if paths:
+        batch = [ replay_series(load_replay(path, 'stats'))
+            for path in paths ]
+    else:
+        rng = np.random.default_rng(BENCHMARK_SEED)
+        batch = [ synthetic_series(rng) for _ in range(BENCHMARK_REPLAYS) ]
+    for batch_size in sorted({ 1, BENCHMARK_BATCH_SIZE, len(batch) }):
+        rows, seconds = run(batch, batch_size)
+        print(f'batch {batch_size:>6}    {len(batch)} replays    '
+            f'{rows} rows    {seconds:.3f}s    '
+            f'{len(batch) / seconds:.0f} replays/s')
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
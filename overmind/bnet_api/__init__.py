@@ -7,21 +7,57 @@ from itertools import dropwhile
 from functools import partial
 from operator import ne
 from time import sleep
+from . import cache
+from overmind import metrics
 import dotenv
 
 dotenv.load_dotenv()
 
-BASE_URL_FORMAT = 'https://us.api.blizzard.com/sc2/profile/{}/{}/{}{}?access_token={}'
+BNET_API_URL = os.environ.get('BNET_API_URL', 'https://us.api.blizzard.com')
+BASE_URL_FORMAT = BNET_API_URL + '/sc2/profile/{}/{}/{}{}?access_token={}'
+TOKEN_URL = os.environ.get(
+    'BNET_TOKEN_URL', 'https://us.battle.net/oauth/token')
 
-_client = BackendApplicationClient(
-    client_id=os.environ['BNET_API_CLIENT_ID'])
-_oauth = OAuth2Session(client=_client)
-_token = _oauth.fetch_token(
-    token_url='https://us.battle.net/oauth/token',
-    client_id=os.environ['BNET_API_CLIENT_ID'],
-    client_secret=os.environ['BNET_API_CLIENT_SECRET'])
+# all created on first use. the http session is per process like the
+# cache connection; the token is plain data and survives a fork.
+_oauth = None
+_oauth_pid = None
+_token = None
 
-_oauth.mount(BASE_URL_FORMAT, HTTPAdapter(max_retries=10))
+# the api couldn't be reached or kept failing. unlike a 404, which is None,
+# nothing is known about the profile, so the replay fails and is retried.
+class BnetUnavailable(Exception):
+    pass
+
+def _session():
+    global _oauth
+    global _oauth_pid
+    if _oauth and _oauth_pid == os.getpid():
+        return _oauth
+    _oauth = OAuth2Session(client=BackendApplicationClient(
+        client_id=os.environ['BNET_API_CLIENT_ID']))
+    _oauth.mount(BASE_URL_FORMAT, HTTPAdapter(max_retries=10))
+    _oauth_pid = os.getpid()
+    return _oauth
+
+def _fetch_token():
+    return _session().fetch_token(
+        token_url=TOKEN_URL,
+        client_id=os.environ['BNET_API_CLIENT_ID'],
+        client_secret=os.environ['BNET_API_CLIENT_SECRET'])
+
+def _get_token():
+    global _token
+    if not _token:
+        _token = _fetch_token()
+    return _token
+
+def close():
+    global _oauth
+    if _oauth and _oauth_pid == os.getpid():
+        _oauth.close()
+    _oauth = None
+    cache.close()
 
 def _build_url(region, subregion, profile_id, endpoint=None):
     return BASE_URL_FORMAT.format(
@@ -29,20 +65,53 @@ def _build_url(region, subregion, profile_id, endpoint=None):
         subregion, 
         profile_id,
         endpoint if endpoint else '',
-        _token['access_token'])
+        _get_token()['access_token'])
 
-def _get(region, subregion, profile_id, endpoint, retries=10):
-    assert retries > 0
+def retry_after(response, default):
     try:
-        response = _oauth.get(_build_url(region, subregion, profile_id, endpoint))
-        if not response.ok:
-            if response.status_code == 429:
-                sleep(5)
-            _get(region, subregion, profile_id, endpoint, retries - 1)
-        return response.json()
-    except:
-        sleep(1)
-        _get(region, subregion, profile_id, endpoint, retries - 1)
+        return max(0.0, float(response.headers.get('Retry-After', default)))
+    except ValueError:
+        return default
+
+def _fetch(region, subregion, profile_id, endpoint, retries=10):
+    global _token
+    for attempt in range(retries):
+        metrics.count('bnet_requests')
+        if attempt:
+            metrics.count('bnet_retries')
+        try:
+            response = _session().get(
+                _build_url(region, subregion, profile_id, endpoint))
+        except Exception:
+            metrics.count('bnet_errors')
+            sleep(min(2 ** attempt, 60))
+            continue
+        if response.ok:
+            return response.json()
+        if response.status_code == 401:
+            metrics.count('bnet_token_refreshes')
+            _token = _fetch_token()
+        elif response.status_code == 404:
+            return None
+        elif response.status_code == 429:
+            metrics.count('bnet_rate_limited')
+            sleep(retry_after(response, min(2 ** attempt, 60)))
+        else:
+            sleep(min(2 ** attempt, 60))
+    raise BnetUnavailable(region, subregion, profile_id, endpoint)
+
+def _get(region, subregion, profile_id, endpoint):
+    kind = cache.endpoint_kind(endpoint)
+    value = cache.get(region, subregion, profile_id, endpoint)
+    if value is not None:
+        metrics.count('bnet_cache', result='hit', kind=kind)
+        return value
+    metrics.count('bnet_cache', result='miss', kind=kind)
+    with metrics.timer('bnet_fetch'):
+        value = _fetch(region, subregion, profile_id, endpoint)
+    if value is not None:
+        cache.put(region, subregion, profile_id, endpoint, value)
+    return value
 
 def get_ladder_summary(region, subregion, profile_id):
     return _get(region, subregion, profile_id, '/ladder/summary')
@@ -50,8 +119,7 @@ def get_ladder_summary(region, subregion, profile_id):
 def get_ladder(region, subregion, profile_id, ladder_id):
     return _get(region, subregion, profile_id, f'/ladder/{ladder_id}')
 
-def get_ladder_showcase_entry(region, subregion, profile_id, game_mode='1v1'):
-    ladder_summary = get_ladder_summary(region, subregion, profile_id)
+def find_showcase_entry(ladder_summary, game_mode='1v1'):
     if not ladder_summary:
         return None
     showcase = tuple(filter(
@@ -59,6 +127,11 @@ def get_ladder_showcase_entry(region, subregion, profile_id, game_mode='1v1'):
         ladder_summary['showCaseEntries']))
     return showcase[0] if showcase else None
 
+def get_ladder_showcase_entry(region, subregion, profile_id, game_mode='1v1'):
+    return find_showcase_entry(
+        get_ladder_summary(region, subregion, profile_id),
+        game_mode)
+
 def get_showcased_ladder(region, subregion, profile_id, game_mode='1v1'):
     showcase = get_ladder_showcase_entry(region, subregion, profile_id, game_mode)
     return get_ladder(region, subregion, profile_id, showcase['ladderId']) \
@@ -68,11 +141,9 @@ def get_showcased_ladder_teams(region, subregion, profile_id, game_mode='1v1'):
     ladder = get_showcased_ladder(region, subregion, profile_id, game_mode)
     return ladder['ladderTeams'] if ladder else None
 
-def get_showcased_ladder_stats(
-    region, subregion, profile_id,
-    game_mode='1v1',
+def ladder_to_ladder_stats(
+    ladder, region, subregion, profile_id,
     flatten=True):
-    ladder = get_showcased_ladder(region, subregion, profile_id)
     ladder_id = ladder['currentLadderMembership']['ladderId'] \
         if ladder else None
     ladder_teams = enumerate(ladder['ladderTeams'], start=1) \
@@ -96,6 +167,15 @@ def get_showcased_ladder_stats(
         del ladder_stats['teamMembers']
     return ladder_stats
 
+def get_showcased_ladder_stats(
+    region, subregion, profile_id,
+    game_mode='1v1',
+    flatten=True):
+    return ladder_to_ladder_stats(
+        get_showcased_ladder(region, subregion, profile_id),
+        region, subregion, profile_id,
+        flatten)
+
 def get_mmr(region, subregion, profile_id, game_mode='1v1'):
     ladder_stats = get_showcased_ladder_stats(
         region, subregion, profile_id, game_mode)
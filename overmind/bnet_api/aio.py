@@ -0,0 +1,265 @@
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import asyncio
+import random
+import time
+import os
+import dotenv
+from . import (
+    cache, find_showcase_entry, ladder_to_ladder_stats, BnetUnavailable)
+from overmind import metrics
+
+dotenv.load_dotenv()
+
+BNET_API_URL = os.environ.get('BNET_API_URL', 'https://us.api.blizzard.com')
+BNET_TOKEN_URL = os.environ.get(
+    'BNET_TOKEN_URL', 'https://us.battle.net/oauth/token')
+BNET_API_CONNECTIONS = int(os.environ.get('BNET_API_CONNECTIONS', 64))
+# blizzard's published quotas: 100 requests/second, 36,000 requests/hour
+BNET_API_RATE_PER_SECOND = float(os.environ.get('BNET_API_RATE_PER_SECOND', 100))
+BNET_API_RATE_PER_HOUR = float(os.environ.get('BNET_API_RATE_PER_HOUR', 36000))
+BNET_API_RETRIES = 10
+BNET_API_MAX_BACKOFF = 60.0
+# refresh the token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # seconds until a token is available, taking it if there is one
+    def take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    def __init__(self, *buckets):
+        self.buckets = buckets
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    # every request waits on the shared limiter, so a Retry-After from one
+    # response holds back all of them instead of each one failing in turn
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                paused = self.paused_until - time.monotonic()
+                if paused > 0:
+                    await asyncio.sleep(paused)
+                    continue
+                waits = [ bucket.take() for bucket in self.buckets ]
+                wait = max(waits)
+                if not wait:
+                    return
+                # give back the tokens taken from buckets that had one
+                for bucket, bucket_wait in zip(self.buckets, waits):
+                    if not bucket_wait:
+                        bucket.tokens += 1
+                await asyncio.sleep(wait)
+
+def _backoff(attempt):
+    return min(BNET_API_MAX_BACKOFF, 2 ** attempt) * (0.5 + random.random() / 2)
+
+def _retry_after(response, default):
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', default)))
+    except ValueError:
+        return default
+
+class Client:
+    def __init__(
+        self,
+        client_id=None,
+        client_secret=None,
+        api_url=BNET_API_URL,
+        token_url=BNET_TOKEN_URL,
+        connections=BNET_API_CONNECTIONS,
+        rate_per_second=BNET_API_RATE_PER_SECOND,
+        rate_per_hour=BNET_API_RATE_PER_HOUR,
+        use_cache=True):
+        self.client_id = client_id or os.environ['BNET_API_CLIENT_ID']
+        self.client_secret = client_secret or os.environ['BNET_API_CLIENT_SECRET']
+        self.api_url = api_url.rstrip('/')
+        self.token_url = token_url
+        self.connections = connections
+        self.limiter = RateLimiter(
+            TokenBucket(rate_per_second, rate_per_second),
+            TokenBucket(rate_per_hour / 3600, rate_per_hour))
+        self.use_cache = use_cache
+        self.stats = dict.fromkeys(
+            ( 'requests', 'retries', 'rate_limited', 'coalesced', 'token_refreshes' ), 0)
+        self._session = None
+        self._token = None
+        self._token_refresh_at = 0.0
+        self._token_lock = None
+        self._in_flight = dict()
+        self._cache_executor = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self):
+        if self._session:
+            return
+        self._token_lock = asyncio.Lock()
+        # the cache is sqlite and may wait on another process's lock, so
+        # it's used from one thread of its own instead of the event loop
+        if self.use_cache:
+            self._cache_executor = ThreadPoolExecutor(1)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.connections,
+                limit_per_host=self.connections,
+                ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=30),
+            raise_for_status=False)
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+        self._session = None
+        if self._cache_executor:
+            self._cache_executor.shutdown()
+        self._cache_executor = None
+
+    async def _cache(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._cache_executor, function, *args)
+
+    # rejected is a token the api turned away. only the first request to
+    # see it rejected fetches a new one, the rest get that one.
+    async def _access_token(self, rejected=None):
+        async with self._token_lock:
+            if self._token and self._token != rejected \
+                and time.monotonic() < self._token_refresh_at:
+                return self._token
+            async with self._session.post(
+                self.token_url,
+                data={ 'grant_type': 'client_credentials' },
+                auth=aiohttp.BasicAuth(self.client_id, self.client_secret)) as response:
+                response.raise_for_status()
+                token = await response.json()
+            expires_in = token.get('expires_in', 86400)
+            self._token = token['access_token']
+            self._token_refresh_at = time.monotonic() \
+                + expires_in - min(TOKEN_REFRESH_MARGIN, expires_in / 2)
+            self.stats['token_refreshes'] += 1
+            metrics.count('bnet_token_refreshes')
+            return self._token
+
+    def _build_url(self, region, subregion, profile_id, endpoint=None):
+        return f'{self.api_url}/sc2/profile/{region}/{subregion}/{profile_id}' \
+            f'{endpoint if endpoint else ""}'
+
+    async def _fetch(self, region, subregion, profile_id, endpoint):
+        url = self._build_url(region, subregion, profile_id, endpoint)
+        rejected = None
+        for attempt in range(BNET_API_RETRIES):
+            token = await self._access_token(rejected)
+            rejected = None
+            await self.limiter.acquire()
+            self.stats['requests'] += 1
+            metrics.count('bnet_requests')
+            if attempt:
+                self.stats['retries'] += 1
+                metrics.count('bnet_retries')
+            try:
+                async with self._session.get(
+                    url,
+                    headers={ 'Authorization': f'Bearer {token}' }) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    if response.status == 404:
+                        return None
+                    if response.status == 401:
+                        rejected = token
+                        continue
+                    if response.status == 429:
+                        self.stats['rate_limited'] += 1
+                        metrics.count('bnet_rate_limited')
+                        self.limiter.pause(_retry_after(response, _backoff(attempt)))
+                        continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.count('bnet_errors')
+            await asyncio.sleep(_backoff(attempt))
+        raise BnetUnavailable(region, subregion, profile_id, endpoint)
+
+    # same metrics as bnet_api._get
+    async def _timed_fetch(self, region, subregion, profile_id, endpoint):
+        with metrics.timer('bnet_fetch'):
+            return await self._fetch(region, subregion, profile_id, endpoint)
+
+    async def _get(self, region, subregion, profile_id, endpoint):
+        kind = cache.endpoint_kind(endpoint)
+        if self.use_cache:
+            value = await self._cache(
+                cache.get, region, subregion, profile_id, endpoint)
+            if value is not None:
+                metrics.count('bnet_cache', result='hit', kind=kind)
+                return value
+            metrics.count('bnet_cache', result='miss', kind=kind)
+        key = (region, subregion, profile_id, endpoint)
+        in_flight = self._in_flight.get(key)
+        if in_flight:
+            self.stats['coalesced'] += 1
+            metrics.count('bnet_coalesced')
+            return await asyncio.shield(in_flight)
+        in_flight = asyncio.ensure_future(
+            self._timed_fetch(region, subregion, profile_id, endpoint))
+        self._in_flight[key] = in_flight
+        in_flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        value = await asyncio.shield(in_flight)
+        if value is not None and self.use_cache:
+            await self._cache(
+                cache.put, region, subregion, profile_id, endpoint, value)
+        return value
+
+    async def get_ladder_summary(self, region, subregion, profile_id):
+        return await self._get(region, subregion, profile_id, '/ladder/summary')
+
+    async def get_ladder(self, region, subregion, profile_id, ladder_id):
+        return await self._get(region, subregion, profile_id, f'/ladder/{ladder_id}')
+
+    async def get_showcased_ladder(
+        self, region, subregion, profile_id, game_mode='1v1'):
+        showcase = find_showcase_entry(
+            await self.get_ladder_summary(region, subregion, profile_id),
+            game_mode)
+        return await self.get_ladder(
+            region, subregion, profile_id, showcase['ladderId']) \
+            if showcase else None
+
+    async def get_showcased_ladder_stats(
+        self, region, subregion, profile_id,
+        game_mode='1v1',
+        flatten=True):
+        return ladder_to_ladder_stats(
+            await self.get_showcased_ladder(
+                region, subregion, profile_id, game_mode),
+            region, subregion, profile_id,
+            flatten)
+
+    async def get_many_showcased_ladder_stats(self, locators, game_mode='1v1'):
+        return await asyncio.gather(*(
+            self.get_showcased_ladder_stats(*locator, game_mode)
+            for locator in locators ))
@@ -0,0 +1,135 @@
+from multiprocessing import Value
+import sqlite3
+import json
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+BNET_CACHE_PATH = os.environ.get('BNET_CACHE_PATH', 'bnet_cache.sqlite')
+BNET_CACHE_MAX_BYTES = int(os.environ.get('BNET_CACHE_MAX_BYTES', 1 << 30))
+BNET_CACHE_EVICT_INTERVAL = 256
+# seconds, by endpoint kind; ladders move faster than summaries
+BNET_CACHE_TTLS = {
+    'summary': int(os.environ.get('BNET_CACHE_SUMMARY_TTL', 7 * 24 * 60 * 60)),
+    'ladder': int(os.environ.get('BNET_CACHE_LADDER_TTL', 24 * 60 * 60)),
+    None: int(os.environ.get('BNET_CACHE_DEFAULT_TTL', 24 * 60 * 60)),
+}
+
+_connection = None
+_connection_pid = None
+_writes = 0
+# shared with forked import workers so the parent can report totals
+_counters = {
+    'hits': Value('Q', 0),
+    'misses': Value('Q', 0),
+}
+
+def endpoint_kind(endpoint):
+    if endpoint == '/ladder/summary':
+        return 'summary'
+    if endpoint and endpoint.startswith('/ladder/'):
+        return 'ladder'
+    return None
+
+def _connect():
+    global _connection
+    global _connection_pid
+    if _connection and _connection_pid == os.getpid():
+        return _connection
+    # the async client uses it from a thread of its own
+    _connection = sqlite3.connect(
+        BNET_CACHE_PATH, timeout=60, isolation_level=None,
+        check_same_thread=False)
+    _connection_pid = os.getpid()
+    _connection.execute('PRAGMA journal_mode=WAL')
+    _connection.execute('PRAGMA synchronous=NORMAL')
+    _connection.execute(
+        'CREATE TABLE IF NOT EXISTS entries ('
+        'region TEXT NOT NULL, '
+        'subregion TEXT NOT NULL, '
+        'profile_id TEXT NOT NULL, '
+        'endpoint TEXT NOT NULL, '
+        'value TEXT NOT NULL, '
+        'size INTEGER NOT NULL, '
+        'fetched_at REAL NOT NULL, '
+        'accessed_at REAL NOT NULL, '
+        'PRIMARY KEY (region, subregion, profile_id, endpoint))')
+    _connection.execute(
+        'CREATE INDEX IF NOT EXISTS idx_accessed_at '
+        'ON entries (accessed_at)')
+    return _connection
+
+def _key(region, subregion, profile_id, endpoint):
+    return str(region), str(subregion), str(profile_id), endpoint or ''
+
+def _count(name):
+    with _counters[name].get_lock():
+        _counters[name].value += 1
+
+def counters():
+    return _counters
+
+def use_counters(counters):
+    global _counters
+    _counters = counters
+
+def stats():
+    return { name: value.value for name, value in _counters.items() }
+
+def get(region, subregion, profile_id, endpoint):
+    key = _key(region, subregion, profile_id, endpoint)
+    connection = _connect()
+    row = connection.execute(
+        'SELECT value, fetched_at FROM entries '
+        'WHERE region = ? AND subregion = ? '
+        'AND profile_id = ? AND endpoint = ?',
+        key).fetchone()
+    now = time.time()
+    if not row or now - row[1] > BNET_CACHE_TTLS[endpoint_kind(endpoint)]:
+        _count('misses')
+        return None
+    connection.execute(
+        'UPDATE entries SET accessed_at = ? '
+        'WHERE region = ? AND subregion = ? '
+        'AND profile_id = ? AND endpoint = ?',
+        (now, *key))
+    _count('hits')
+    return json.loads(row[0])
+
+def put(region, subregion, profile_id, endpoint, value):
+    global _writes
+    key = _key(region, subregion, profile_id, endpoint)
+    value = json.dumps(value)
+    now = time.time()
+    _connect().execute(
+        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (*key, value, len(value), now, now))
+    _writes += 1
+    if _writes % BNET_CACHE_EVICT_INTERVAL == 0:
+        evict()
+
+# drops least recently used entries until the cache fits
+def evict(max_bytes=None):
+    max_bytes = BNET_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    connection = _connect()
+    size, = connection.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+    if size <= max_bytes:
+        return 0
+    evicted = 0
+    for rowid, entry_size in connection.execute(
+        'SELECT rowid, size FROM entries ORDER BY accessed_at').fetchall():
+        if size <= max_bytes:
+            break
+        connection.execute('DELETE FROM entries WHERE rowid = ?', (rowid,))
+        size -= entry_size
+        evicted += 1
+    return evicted
+
+def close():
+    global _connection
+    if _connection and _connection_pid == os.getpid():
+        _connection.close()
+    _connection = None
@@ -0,0 +1,194 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread, Lock
+import random
+import json
+import time
+import re
+import sys
+
+# local stand-in for the battle.net sc2 profile api, serving deterministic
+# synthetic ladders so the clients can be exercised offline
+
+LADDER_SIZE = 100
+LADDER_ID_OFFSET = 200000
+RACES = ( 'Protoss', 'Terran', 'Zerg', 'Random' )
+
+_profile_re = re.compile(
+    r'^/sc2/profile/(?P<region>\d+)/(?P<realm>\d+)/(?P<profile_id>\d+)'
+    r'/ladder/(?P<ladder>summary|\d+)$')
+
+def ladder_id_for(profile_id):
+    return LADDER_ID_OFFSET + int(profile_id) // LADDER_SIZE
+
+def ladder_member(region, realm, profile_id):
+    rng = random.Random(int(profile_id))
+    return {
+        'teamMembers': [ {
+            'id': str(profile_id),
+            'realm': int(realm),
+            'region': int(region),
+            'displayName': f'player{profile_id}'[:12],
+            'clanTag': rng.choice(( '', 'stub' )),
+            'favoriteRace': rng.choice(RACES).lower(),
+        } ],
+        'previousRank': rng.randrange(1, LADDER_SIZE + 1),
+        'points': rng.randrange(0, 2000),
+        'wins': rng.randrange(0, 300),
+        'losses': rng.randrange(0, 300),
+        'mmr': rng.randrange(1500, 7000),
+        'joinTimestamp': 1577836800 + rng.randrange(0, 10**7),
+    }
+
+def ladder_summary(region, realm, profile_id):
+    return {
+        'showCaseEntries': [ {
+            'ladderId': str(ladder_id_for(profile_id)),
+            'team': {
+                'localizedGameMode': '1v1',
+                'members': [ { 'id': str(profile_id) } ],
+            },
+            'leagueName': 'GRANDMASTER',
+        } ],
+        'placementMatches': [],
+        'allLadderMemberships': [ {
+            'ladderId': str(ladder_id_for(profile_id)),
+            'localizedGameMode': '1v1',
+        } ],
+    }
+
+def ladder(region, realm, ladder_id):
+    first = (int(ladder_id) - LADDER_ID_OFFSET) * LADDER_SIZE
+    return {
+        'ladderTeams': sorted(
+            ( ladder_member(region, realm, profile_id)
+                for profile_id in range(first, first + LADDER_SIZE) ),
+            key=lambda x: -x['mmr']),
+        'currentLadderMembership': {
+            'ladderId': str(ladder_id),
+            'localizedGameMode': '1v1',
+        },
+    }
+
+class StubServer:
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=0,
+        latency=0.0,
+        rate_per_second=None,
+        token_ttl=86400):
+        self.latency = latency
+        self.rate_per_second = rate_per_second
+        self.token_ttl = token_ttl
+        self.requests = 0
+        self.rate_limited = 0
+        self.tokens_issued = 0
+        self._lock = Lock()
+        self._tokens = dict()
+        self._window = (0, 0)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def token_url(self):
+        return f'{self.url}/oauth/token'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _issue_token(self):
+        with self._lock:
+            self.tokens_issued += 1
+            token = f'stub-{self.tokens_issued}'
+            self._tokens[token] = time.monotonic() + self.token_ttl
+        return { 'access_token': token, 'token_type': 'bearer', 'expires_in': self.token_ttl }
+
+    def _is_authorized(self, token):
+        with self._lock:
+            return self._tokens.get(token, 0) > time.monotonic()
+
+    def _is_rate_limited(self):
+        if not self.rate_per_second:
+            return False
+        with self._lock:
+            second, count = self._window
+            now = int(time.monotonic())
+            if now != second:
+                second, count = now, 0
+            self._window = (second, count + 1)
+            limited = count >= self.rate_per_second
+            self.rate_limited += limited
+            return limited
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=()):
+                payload = json.dumps(body if body is not None else {}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if urlsplit(self.path).path != '/oauth/token':
+                    return self._send(404)
+                self._send(200, server._issue_token())
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlsplit(self.path)
+                token = self.headers.get('Authorization', '')[len('Bearer '):] \
+                    or parse_qs(url.query).get('access_token', [ '' ])[0]
+                if not server._is_authorized(token):
+                    return self._send(401)
+                if server._is_rate_limited():
+                    return self._send(429, headers=(( 'Retry-After', '1' ),))
+                match = _profile_re.match(url.path)
+                if not match:
+                    return self._send(404)
+                if match['ladder'] == 'summary':
+                    return self._send(200, ladder_summary(
+                        match['region'], match['realm'], match['profile_id']))
+                if ladder_id_for(match['profile_id']) != int(match['ladder']):
+                    return self._send(404)
+                self._send(200, ladder(
+                    match['region'], match['realm'], match['ladder']))
+
+        return Handler
+
+if __name__ == '__main__':
+    with StubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080) as server:
+        print(f'{server.url}    {server.token_url}')
+        server._thread.join()
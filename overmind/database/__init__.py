@@ -1,12 +1,109 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import NullPool, QueuePool
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
 import os
 import dotenv
 
 dotenv.load_dotenv()
 
-_engine = create_engine(os.environ['DATABASE_CONNECTION_STRING'])
-session_factory = sessionmaker(bind=_engine)
-Session = scoped_session(session_factory)
-pass
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 8))
+# seconds to wait for a pooled connection before giving up
+DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', 60))
+DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+DATABASE_POOL_PRE_PING = bool(int(os.environ.get('DATABASE_POOL_PRE_PING', 1)))
+# milliseconds, 0 for none
+DATABASE_STATEMENT_TIMEOUT = int(
+    os.environ.get('DATABASE_STATEMENT_TIMEOUT', 0))
+# behind pgbouncer or similar: no pool of our own, and no session state,
+# so the statement timeout is set per transaction
+DATABASE_EXTERNAL_POOLER = bool(
+    int(os.environ.get('DATABASE_EXTERNAL_POOLER', 0)))
 
+_engine = None
+_engine_pid = None
+# engines inherited over fork. their pooled connections share sockets with
+# the parent, so the child must neither use nor close them; holding on to
+# them keeps the connections from being finalized.
+_inherited_engines = list()
+
+def engine_options(url):
+    options = dict()
+    if DATABASE_EXTERNAL_POOLER:
+        options['poolclass'] = NullPool
+    else:
+        options.update(
+            poolclass=QueuePool,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+            pool_pre_ping=DATABASE_POOL_PRE_PING)
+        if DATABASE_STATEMENT_TIMEOUT and url.startswith('postgresql'):
+            options['connect_args'] = {
+                'options': f'-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}' }
+    # pooled sqlite connections move between threads
+    if url.startswith('sqlite'):
+        options['connect_args'] = { 'check_same_thread': False }
+    return options
+
+def _set_local_statement_timeout(connection):
+    connection.execute(
+        f'SET LOCAL statement_timeout = {DATABASE_STATEMENT_TIMEOUT}')
+
+# created on first use and again in any forked child that uses it, so
+# importing overmind.database never connects
+def get_engine():
+    global _engine
+    global _engine_pid
+    if _engine and _engine_pid == os.getpid():
+        return _engine
+    if _engine:
+        _inherited_engines.append(_engine)
+    url = os.environ['DATABASE_CONNECTION_STRING']
+    _engine = create_engine(url, **engine_options(url))
+    if DATABASE_EXTERNAL_POOLER and DATABASE_STATEMENT_TIMEOUT:
+        event.listen(_engine, 'begin', _set_local_statement_timeout)
+    _engine_pid = os.getpid()
+    return _engine
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        local_kw.setdefault('bind', get_engine())
+        return super().__call__(**local_kw)
+
+session_factory = _LazySessionmaker()
+# per process as well as per thread, a forked child never picks up the
+# parent's session
+Session = scoped_session(
+    session_factory,
+    scopefunc=lambda: (os.getpid(), threading.get_ident()))
+
+_unit_of_work = ContextVar('unit_of_work', default=None)
+
+def current_session():
+    return _unit_of_work.get()
+
+# one session, one connection and one transaction for everything inside,
+# committed at the end or rolled back on error. queries called with no
+# session join it instead of checking out a connection each.
+@contextmanager
+def unit_of_work():
+    session = current_session()
+    if session:
+        yield session
+        return
+    session = session_factory()
+    token = _unit_of_work.set(session)
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        _unit_of_work.reset(token)
+        session.close()
@@ -50,13 +50,33 @@ class Map(Base):
 
 class BattleNetInfoReplayAssociation(Base):
     __tablename__ = 'battle_net_info_replay_association'
+    # the primary key leads with battle_net_info_id, this covers replay to
+    # players
+    __table_args__ = (
+        Index('idx_battle_net_info_replay_association_replay_id',
+            'replay_id'),
+    )
     battle_net_info_id = Column(Integer, ForeignKey('battle_net_info.id'), primary_key=True)
     replay_id = Column(Integer, ForeignKey('replays.id'), primary_key=True)
+    # race played in this replay, not the profile's favorite
+    race = Column(Enum(Race))
     battle_net_info = relationship('BattleNetInfo', back_populates='replays')
     replay = relationship('Replay', back_populates='battle_net_info_replays')
 
 class Replay(Base):
     __tablename__ = 'replays'
+    # btree throughout: replays are written in the order the parallel walk
+    # finds them, not by start_time, so a brin range would span most of it
+    __table_args__ = (
+        Index('idx_replays_start_time', 'start_time'),
+        Index('idx_replays_region_start_time', 'region', 'start_time'),
+        Index('idx_replays_map_id_start_time', 'map_id', 'start_time'),
+        Index('idx_replays_winner_id', 'winner_id'),
+        # versions @> ARRAY[...], e.g. every replay of a base build
+        Index('idx_replays_versions',
+            'versions',
+            postgresql_using='gin'),
+    )
     id = Column(Integer, primary_key=True)
     file_hash = Column(BYTEA(32), unique=True, index=True)
     original_path = Column(BYTEA)
@@ -78,6 +98,7 @@ class Replay(Base):
     winner_id = Column(Integer, ForeignKey('battle_net_info.id'))
     winner = relationship('BattleNetInfo')
     battle_net_info_replays = relationship('BattleNetInfoReplayAssociation')
+    stats = relationship('ReplayStats', back_populates='replay', uselist=False)
     battle_net_infos = association_proxy(
         'battle_net_info_replays', 'battle_net_info',
         creator=lambda x: BattleNetInfoReplayAssociation(
@@ -89,6 +110,7 @@ class BattleNetInfo(Base):
         Index('idx_locator', 
             'profile_id', 'region', 'realm', 
             unique=True),
+        Index('idx_battle_net_info_ladder_id', 'ladder_id'),
     )
     id = Column(Integer, primary_key=True)
     profile_id = Column(Integer, nullable=False)
@@ -109,6 +131,28 @@ class BattleNetInfo(Base):
     player_id = Column(Integer, ForeignKey('players.id'))
     player = relationship('Player', back_populates='battle_net_infos')
     replays = relationship('BattleNetInfoReplayAssociation')
+    history = relationship(
+        'BattleNetInfoHistory', back_populates='battle_net_info')
+
+# ladder standings over time, a row per player each time a ladder refresh
+# finds them, see overmind.ladder_refresh
+class BattleNetInfoHistory(Base):
+    __tablename__ = 'battle_net_info_history'
+    __table_args__ = (
+        Index('idx_battle_net_info_history',
+            'battle_net_info_id', 'recorded_at'),
+    )
+    id = Column(Integer, primary_key=True)
+    battle_net_info_id = Column(
+        Integer, ForeignKey('battle_net_info.id'), nullable=False)
+    recorded_at = Column(DateTime, nullable=False)
+    ladder_id = Column(Integer)
+    mmr = Column(Integer)
+    rank = Column(Integer)
+    points = Column(Integer)
+    wins = Column(Integer)
+    losses = Column(Integer)
+    battle_net_info = relationship('BattleNetInfo', back_populates='history')
 
 class Team(Base):
     __tablename__ = 'teams'
@@ -127,3 +171,40 @@ class Player(Base):
     team_id = Column(Integer, ForeignKey('teams.id'))
     battle_net_infos = relationship('BattleNetInfo', back_populates='player')
 
+
+class ReplayStats(Base):
+    __tablename__ = 'replay_stats'
+    file_hash = Column(BYTEA(32), ForeignKey('replays.file_hash'), primary_key=True)
+    pids = Column(ARRAY(Integer), nullable=False)
+    fields = Column(ARRAY(String), nullable=False)
+    # .npy of float32 (players, samples, fields), see overmind.timeseries
+    player_stats = Column(BYTEA, nullable=False)
+    # .npy of float32 (events, UNIT_EVENT_FIELDS)
+    unit_events = Column(BYTEA)
+    replay = relationship('Replay', back_populates='stats')
+
+    def __repr__(self):
+        return super().__repr__(self.file_hash.hex())
+
+# win/loss aggregates, one row per race vs opponent race per map, release
+# and region. each 1v1 counts once from either player's side, so mirrors
+# count a win and a loss on the same row. kept up to date by the importer
+# as batches commit, see queries.increment_win_loss_cube.
+class WinLossCube(Base):
+    __tablename__ = 'win_loss_cube'
+    race = Column(Enum(Race), primary_key=True)
+    opponent_race = Column(Enum(Race), primary_key=True)
+    map_id = Column(Integer, ForeignKey('maps.id'), primary_key=True)
+    release = Column(String(16), primary_key=True)
+    region = Column(String(2), primary_key=True)
+    wins = Column(Integer, nullable=False)
+    losses = Column(Integer, nullable=False)
+    games = Column(Integer, nullable=False)
+    # sum of real_length, for mean game length
+    seconds = Column(Float, nullable=False)
+    map = relationship('Map')
+
+    def __repr__(self):
+        return super().__repr__(
+            f'{self.race.name[0]}v{self.opponent_race.name[0]} '
+            f'{self.map_id} {self.release} {self.region}')
@@ -1,14 +1,19 @@
 from .models import (
-    Race, ReplayDataPath, Map, Replay,
-    BattleNetInfo, Team, Player)
+    ReplayDataPath, Map, Replay,
+    BattleNetInfo, Team, Player, ReplayStats,
+    BattleNetInfoReplayAssociation, WinLossCube, BattleNetInfoHistory)
+from sqlalchemy import tuple_, func, case, and_
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert
 from functools import wraps
-from . import Session
+from . import Session, current_session
 
+# with no session, a query joins the current unit_of_work if there is one
 def query(query_func):
     @wraps(query_func)
     def _query(session, *args, **kwargs) -> (Session, object):
         if not session:
-            session = Session()
+            session = current_session() or Session()
         return session, query_func(session, *args, **kwargs)
     return _query
 
@@ -69,12 +74,241 @@ def get_replay_by_file_hash(session, file_hash):
 def get_map_by_file_hash(session, file_hash):
     return _get(session, Map, file_hash=file_hash)
 
+@query
+def get_replay_stats_by_file_hash(session, file_hash):
+    return _get(session, ReplayStats, file_hash=file_hash)
+
 @query
 def get_replay_data_path(session):
     return session.query(
         ReplayDataPath.replay_data_path).first()[0]
 
+@query
+def get_replay_file_hashes(session):
+    return { bytes(file_hash)
+        for file_hash, in session.query(Replay.file_hash) \
+            .filter(Replay.file_hash.isnot(None)) }
+
+
+def _key(value):
+    return bytes(value) if isinstance(value, memoryview) else value
+
+@query
+def insert_on_conflict_do_nothing(
+    session, entity, rows, index_elements=None, returning=()):
+    rows = list(rows)
+    if not rows:
+        return list()
+    statement = insert(entity) \
+        .values(rows) \
+        .on_conflict_do_nothing(index_elements=index_elements)
+    if not returning:
+        session.execute(statement)
+        return list()
+    return session.execute(statement.returning(*returning)).fetchall()
+
+@query
+def get_ids_by_column(session, entity, column_name, values):
+    values = list(values)
+    if not values:
+        return dict()
+    column = getattr(entity, column_name)
+    return { _key(value): id
+        for id, value in session.query(entity.id, column) \
+            .filter(column.in_(values)) }
+
+@query
+def get_battle_net_info_ids_by_locators(session, locators):
+    locators = list(locators)
+    if not locators:
+        return dict()
+    locator = tuple_(
+        BattleNetInfo.region,
+        BattleNetInfo.realm,
+        BattleNetInfo.profile_id)
+    return { (region, realm, profile_id): id
+        for id, region, realm, profile_id in session.query(
+            BattleNetInfo.id,
+            BattleNetInfo.region,
+            BattleNetInfo.realm,
+            BattleNetInfo.profile_id) \
+            .filter(locator.in_(locators)) }
+
+_id_columns = {
+    'maps': (Map, 'file_hash'),
+    'players': (Player, 'pro_name'),
+}
+
+@query
+def get_all_ids_by_column(session, kind):
+    entity, column_name = _id_columns[kind]
+    column = getattr(entity, column_name)
+    return { _key(value): id
+        for id, value in session.query(entity.id, column) \
+            .filter(column.isnot(None)) }
+
+@query
+def get_all_battle_net_info_ids(session):
+    return { (region, realm, profile_id): id
+        for id, region, realm, profile_id in session.query(
+            BattleNetInfo.id,
+            BattleNetInfo.region,
+            BattleNetInfo.realm,
+            BattleNetInfo.profile_id) }
+
+# ladder_id -> locators of the players last seen on that ladder
+@query
+def get_battle_net_info_locators_by_ladder(session):
+    ladders = dict()
+    for ladder_id, region, realm, profile_id in session.query(
+            BattleNetInfo.ladder_id,
+            BattleNetInfo.region,
+            BattleNetInfo.realm,
+            BattleNetInfo.profile_id) \
+            .filter(BattleNetInfo.ladder_id.isnot(None)) \
+            .order_by(BattleNetInfo.ladder_id, BattleNetInfo.id):
+        ladders.setdefault(ladder_id, list()) \
+            .append((region, realm, profile_id))
+    return ladders
+
+_ladder_history_columns = (
+    'ladder_id', 'mmr', 'rank', 'points', 'wins', 'losses' )
 
+# rows are battle_net_info columns with their id, each also recorded in the
+# history. sorted so concurrent refreshes lock rows in the same order.
+@query
+def update_ladder_standings(session, rows, recorded_at):
+    rows = sorted(rows, key=lambda row: row['id'])
+    if not rows:
+        return
+    session.bulk_update_mappings(BattleNetInfo, rows)
+    session.execute(insert(BattleNetInfoHistory).values([ {
+        'battle_net_info_id': row['id'],
+        'recorded_at': recorded_at,
+        **{ k: row.get(k) for k in _ladder_history_columns } }
+        for row in rows ]))
+
+_win_loss_key = ( 'race', 'opponent_race', 'map_id', 'release', 'region' )
+_win_loss_values = ( 'wins', 'losses', 'games', 'seconds' )
+
+# rows are summed into any existing row for the same key. rows are sorted
+# so concurrent writers lock cube rows in the same order.
+@query
+def increment_win_loss_cube(session, rows):
+    rows = sorted(
+        rows,
+        key=lambda row: tuple(
+            getattr(row[k], 'name', row[k]) for k in _win_loss_key ))
+    if not rows:
+        return
+    statement = insert(WinLossCube).values(rows)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=_win_loss_key,
+        set_={ k: getattr(WinLossCube, k) + getattr(statement.excluded, k)
+            for k in _win_loss_values }))
+
+def release_from_versions(versions):
+    return '.'.join(map(str, versions[1:4]))
 
+# (replay file_hash, locator, battle_net_info_id, replay_id) for every
+# association written before races were recorded
+@query
+def get_associations_without_race(session):
+    return [ (bytes(file_hash), (region, realm, profile_id), *ids)
+        for file_hash, region, realm, profile_id, *ids in session.query(
+            Replay.file_hash,
+            BattleNetInfo.region,
+            BattleNetInfo.realm,
+            BattleNetInfo.profile_id,
+            BattleNetInfoReplayAssociation.battle_net_info_id,
+            BattleNetInfoReplayAssociation.replay_id) \
+            .join(BattleNetInfoReplayAssociation,
+                BattleNetInfoReplayAssociation.replay_id == Replay.id) \
+            .join(BattleNetInfo,
+                BattleNetInfo.id
+                    == BattleNetInfoReplayAssociation.battle_net_info_id) \
+            .filter(BattleNetInfoReplayAssociation.race.is_(None)) \
+            .order_by(Replay.id) ]
 
+# rows of battle_net_info_id, replay_id and race
+@query
+def set_association_races(session, rows):
+    session.bulk_update_mappings(BattleNetInfoReplayAssociation, rows)
 
+# file_hash of every replay_stats row of a replay with a player of race
+@query
+def get_replay_stats_file_hashes_by_race(session, race):
+    return [ bytes(file_hash) for file_hash, in session.query(
+            ReplayStats.file_hash) \
+        .join(Replay, Replay.file_hash == ReplayStats.file_hash) \
+        .join(BattleNetInfoReplayAssociation,
+            BattleNetInfoReplayAssociation.replay_id == Replay.id) \
+        .filter(BattleNetInfoReplayAssociation.race == race) \
+        .distinct() \
+        .order_by(ReplayStats.file_hash) ]
+
+# rows of file_hash and unit_events
+@query
+def set_replay_stats_unit_events(session, rows):
+    session.bulk_update_mappings(ReplayStats, rows)
+
+# recomputes the whole cube from replays, for backfills and after deletes.
+# associations with no race are left out, run replay_importer.backfill
+# first on a database imported before races were recorded.
+@query
+def rebuild_win_loss_cube(session):
+    player = aliased(BattleNetInfoReplayAssociation)
+    opponent = aliased(BattleNetInfoReplayAssociation)
+    won = player.battle_net_info_id == Replay.winner_id
+    columns = (
+        player.race,
+        opponent.race,
+        Replay.map_id,
+        func.array_to_string(Replay.versions[2:4], '.'),
+        Replay.region)
+    rows = session.query(
+        *columns,
+        func.sum(case([(won, 1)], else_=0)),
+        func.sum(case([(won, 0)], else_=1)),
+        func.count(),
+        func.sum(func.extract('epoch', Replay.real_length))) \
+        .join(player, player.replay_id == Replay.id) \
+        .join(opponent, and_(
+            opponent.replay_id == Replay.id,
+            opponent.battle_net_info_id != player.battle_net_info_id)) \
+        .filter(
+            Replay.real_type == '1v1',
+            Replay.map_id.isnot(None),
+            player.race.isnot(None),
+            opponent.race.isnot(None)) \
+        .group_by(*columns)
+    session.query(WinLossCube).delete()
+    session.execute(insert(WinLossCube).from_select(
+        _win_loss_key + _win_loss_values, rows))
+
+# sums of the cube grouped by any of its key columns, filtered by any
+# of them, e.g. get_win_loss(None, ('map_id', 'race'), region='eu')
+@query
+def get_win_loss(session, group_by=('race', 'opponent_race'), **filters):
+    columns = [ getattr(WinLossCube, k) for k in group_by ]
+    games = func.sum(WinLossCube.games)
+    return session.query(
+        *columns,
+        func.sum(WinLossCube.wins).label('wins'),
+        func.sum(WinLossCube.losses).label('losses'),
+        games.label('games'),
+        (func.sum(WinLossCube.seconds) / func.nullif(games, 0)) \
+            .label('mean_seconds')) \
+        .filter_by(**filters) \
+        .group_by(*columns) \
+        .order_by(*columns) \
+        .all()
+
+@query
+def get_race_win_loss(session, **filters):
+    return get_win_loss(session, ('race', 'opponent_race'), **filters)[1]
+
+@query
+def get_map_win_loss(session, **filters):
+    return get_win_loss(
+        session, ('map_id', 'race', 'opponent_race'), **filters)[1]
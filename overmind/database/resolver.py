@@ -0,0 +1,58 @@
+from threading import RLock
+from .queries import (
+    get_all_ids_by_column,
+    get_all_battle_net_info_ids)
+
+# run-scoped identity map of natural keys to row ids. ids learned inside a
+# transaction stay pending until commit() so a rollback can't leak them.
+class Resolver:
+    kinds = ( 'maps', 'players', 'battle_net_infos' )
+
+    def __init__(self):
+        self._lock = RLock()
+        self._ids = { kind: dict() for kind in self.kinds }
+        self._pending = { kind: dict() for kind in self.kinds }
+
+    def preload(self, session):
+        session, maps = get_all_ids_by_column(session, 'maps')
+        session, players = get_all_ids_by_column(session, 'players')
+        session, battle_net_infos = get_all_battle_net_info_ids(session)
+        with self._lock:
+            self._ids['maps'].update(maps)
+            self._ids['players'].update(players)
+            self._ids['battle_net_infos'].update(battle_net_infos)
+        return session, self
+
+    def get(self, kind, key):
+        with self._lock:
+            id = self._pending[kind].get(key)
+            return id if id is not None else self._ids[kind].get(key)
+
+    def __contains__(self, kind_and_key):
+        return self.get(*kind_and_key) is not None
+
+    def resolve(self, kind, keys):
+        with self._lock:
+            return { key: id
+                for key in keys
+                for id in ( self.get(kind, key), )
+                if id is not None }
+
+    def register(self, kind, ids):
+        with self._lock:
+            self._pending[kind].update(ids)
+
+    def commit(self):
+        with self._lock:
+            for kind in self.kinds:
+                self._ids[kind].update(self._pending[kind])
+                self._pending[kind].clear()
+
+    def rollback(self):
+        with self._lock:
+            for kind in self.kinds:
+                self._pending[kind].clear()
+
+    def keys(self, kind):
+        with self._lock:
+            return frozenset(self._ids[kind])
@@ -0,0 +1,153 @@
+from overmind import metrics
+from overmind.bnet_api import BnetUnavailable, find_showcase_entry
+from overmind.bnet_api.aio import Client
+from overmind.database import unit_of_work
+from overmind.database.queries import (
+    get_all_battle_net_info_ids,
+    get_battle_net_info_locators_by_ladder,
+    update_ladder_standings)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+# ladders fetched at once, the client's rate limiter has the final say
+LADDER_REFRESH_CONCURRENCY = int(
+    os.environ.get('LADDER_REFRESH_CONCURRENCY', 16))
+# members asked for a ladder before giving up on it; a player who has left
+# the ladder gets a 404 for it
+LADDER_REFRESH_ATTEMPTS = int(os.environ.get('LADDER_REFRESH_ATTEMPTS', 3))
+# battle_net_info rows per update
+LADDER_REFRESH_BATCH_SIZE = int(
+    os.environ.get('LADDER_REFRESH_BATCH_SIZE', 1000))
+
+# (locator, battle_net_info columns) for every team on the ladder. rank is
+# the position on the ladder, as in bnet_api.ladder_to_ladder_stats.
+def ladder_standings(ladder, ladder_id):
+    for rank, team in enumerate(ladder['ladderTeams'], start=1):
+        member = team['teamMembers'][0]
+        yield (member['region'], member['realm'], int(member['id'])), {
+            'ladder_id': int(ladder_id),
+            'rank': rank,
+            'mmr': team.get('mmr'),
+            'points': team.get('points'),
+            'previous_rank': team.get('previousRank'),
+            'wins': team.get('wins'),
+            'losses': team.get('losses') }
+
+async def _fetch_ladder(client, semaphore, ladder_id, locators):
+    async with semaphore:
+        for locator in locators[:LADDER_REFRESH_ATTEMPTS]:
+            try:
+                ladder = await client.get_ladder(*locator, ladder_id)
+            except BnetUnavailable:
+                metrics.count('ladder_refresh_errors')
+                continue
+            if ladder and ladder.get('ladderTeams'):
+                return ladder_id, ladder
+    return ladder_id, None
+
+# the 1v1 ladder the profile is on now, from its ladder summary
+async def _current_ladder_id(client, semaphore, locator):
+    async with semaphore:
+        try:
+            summary = await client.get_ladder_summary(*locator)
+        except BnetUnavailable:
+            metrics.count('ladder_refresh_errors')
+            return locator, None
+    showcase = find_showcase_entry(summary)
+    return locator, int(showcase['ladderId']) if showcase else None
+
+async def _fetched_ladders(client, semaphore, ladders):
+    for future in asyncio.as_completed([
+            _fetch_ladder(client, semaphore, ladder_id, locators)
+            for ladder_id, locators in ladders.items() ]):
+        ladder_id, ladder = await future
+        if not ladder:
+            metrics.count('ladder_refresh_ladders', result='missing')
+            continue
+        metrics.count('ladder_refresh_ladders', result='fetched')
+        yield ladder_id, ladder
+
+def _write(rows, recorded_at):
+    with metrics.timer('ladder_refresh_write'), unit_of_work() as session:
+        update_ladder_standings(session, rows, recorded_at)
+
+# one request per known ladder rather than two per player: every known
+# player found on a fetched ladder is updated from it, whichever ladder
+# they were last seen on. players on none of them, like everyone after a
+# season rolls over, have their current ladder looked up from their
+# summary and that ladder is fetched instead.
+async def refresh(
+    client_options=None,
+    concurrency=LADDER_REFRESH_CONCURRENCY,
+    batch_size=LADDER_REFRESH_BATCH_SIZE):
+    with unit_of_work() as session:
+        _, ladders = get_battle_net_info_locators_by_ladder(session)
+        _, battle_net_info_ids = get_all_battle_net_info_ids(session)
+    recorded_at = datetime.utcnow()
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    fetched = set()
+    updated = set()
+    rows = list()
+    with ThreadPoolExecutor(1) as executor:
+        async def update(ladders):
+            async for ladder_id, ladder in _fetched_ladders(
+                    client, semaphore, ladders):
+                fetched.add(ladder_id)
+                for locator, columns in ladder_standings(ladder, ladder_id):
+                    id = battle_net_info_ids.get(locator)
+                    if id is None or id in updated:
+                        continue
+                    updated.add(id)
+                    rows.append({ 'id': id, **columns })
+                if len(rows) >= batch_size:
+                    await loop.run_in_executor(
+                        executor, _write, list(rows), recorded_at)
+                    rows.clear()
+        # the cache would hand back the standings this is meant to replace
+        async with Client(use_cache=False, **(client_options or dict())) \
+            as client:
+            await update(ladders)
+            moved = dict()
+            for future in asyncio.as_completed([
+                    _current_ladder_id(client, semaphore, locator)
+                    for locators in ladders.values()
+                    for locator in locators
+                    if battle_net_info_ids[locator] not in updated ]):
+                locator, ladder_id = await future
+                if ladder_id is None or ladder_id in fetched:
+                    metrics.count('ladder_refresh_moved', result='missing')
+                    continue
+                metrics.count('ladder_refresh_moved', result='found')
+                moved.setdefault(ladder_id, list()).append(locator)
+            await update(moved)
+            requests = client.stats['requests']
+        if rows:
+            await loop.run_in_executor(executor, _write, rows, recorded_at)
+    metrics.count('ladder_refresh_players', len(updated))
+    metrics.count('ladder_refresh_requests', requests)
+    return {
+        'ladders': len(ladders),
+        'moved': len(moved),
+        'players': len(battle_net_info_ids),
+        'updated': len(updated),
+        'requests': requests }
+
+def main():
+    start = time.perf_counter()
+    result = asyncio.run(refresh())
+    print(f'{result["updated"]} of {result["players"]} players updated '
+        f'from {result["ladders"]} ladders and {result["moved"]} they moved '
+        f'to with {result["requests"]} requests    '
+        f'{time.perf_counter() - start:.1f}s')
+    print(metrics.format_counters())
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Thread, Event, Lock
+import numpy as np
+import json
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+PERCENTILES = (50, 95, 99)
+# seconds, upper bounds of the exported histogram buckets
+HISTOGRAM_BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, float('inf'))
+# a .prom path is written in the prometheus textfile format, anything
+# else as json. unset turns periodic export off.
+METRICS_PATH = os.environ.get('METRICS_PATH')
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', 15))
+METRICS_PREFIX = 'overmind'
+
+# seconds per call, by stage, for this process. import workers hand theirs
+# back with each result, see drain and merge.
+_samples = defaultdict(list)
+# (name, ((label, value), ...)) -> total, or last value for gauges
+_counters = defaultdict(int)
+_gauges = dict()
+_lock = Lock()
+
+# another thread may hold the lock at the moment a worker is forked
+def _reset_lock():
+    global _lock
+    _lock = Lock()
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+# every change and every read of the dicts holds the lock, the exporter
+# thread walks them while pipeline threads and the writer add to them
+def record(stage, seconds):
+    with _lock:
+        _samples[stage].append(seconds)
+
+@contextmanager
+def timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def count(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+def gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def _copy_samples():
+    return { stage: list(values) for stage, values in _samples.items() }
+
+def samples():
+    with _lock:
+        return _copy_samples()
+
+def _counters_by_name():
+    return { name: total for (name, labels), total in _counters.items()
+        if not labels } \
+        | { f'{name}{{{_format_labels(labels)}}}': total
+            for (name, labels), total in _counters.items()
+            if labels }
+
+def counters():
+    with _lock:
+        return _counters_by_name()
+
+def drain():
+    global _samples
+    global _counters
+    with _lock:
+        drained = {
+            'samples': dict(_samples),
+            'counters': dict(_counters) }
+        _samples, _counters = defaultdict(list), defaultdict(int)
+    return drained
+
+def merge(drained):
+    with _lock:
+        for stage, values in drained['samples'].items():
+            _samples[stage].extend(values)
+        for key, value in drained['counters'].items():
+            _counters[key] += value
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counters.clear()
+        _gauges.clear()
+
+# elapsed is the wall clock of the whole run, for throughput. stages run
+# concurrently in workers, so totals can add up to more than elapsed.
+def summary(samples=None, elapsed=None):
+    if samples is None:
+        with _lock:
+            samples = _copy_samples()
+    def summarize(values):
+        values = np.asarray(values, dtype=np.float64)
+        return {
+            'count': len(values),
+            'total': float(values.sum()),
+            'mean': float(values.mean()),
+            'max': float(values.max()),
+            **{ f'p{p}': float(np.percentile(values, p))
+                for p in PERCENTILES },
+            'per_second': len(values) / elapsed if elapsed else None }
+    return { stage: summarize(values)
+        for stage, values in sorted(samples.items())
+        if values }
+
+def format_summary(summary):
+    return '\n'.join(
+        f'{stage:<16}{stats["count"]:>8}    '
+        + '    '.join(
+            f'p{p} {stats[f"p{p}"] * 1000:.2f}ms' for p in PERCENTILES)
+        + (f'    {stats["per_second"]:.1f}/s'
+            if stats['per_second'] else '')
+        for stage, stats in summary.items() )
+
+def format_counters():
+    return '\n'.join(
+        f'{name:<40}{total}' for name, total in sorted(counters().items()) )
+
+def snapshot(elapsed=None):
+    with _lock:
+        return {
+            'time': time.time(),
+            'elapsed': elapsed,
+            'stages': summary(_samples, elapsed),
+            'counters': _counters_by_name(),
+            'gauges': {
+                f'{name}{{{_format_labels(labels)}}}' if labels else name:
+                    value
+                for (name, labels), value in _gauges.items() } }
+
+def _format_labels(labels):
+    return ','.join( f'{k}="{v}"' for k, v in labels )
+
+def _metric_name(name):
+    return f'{METRICS_PREFIX}_{name}'
+
+def prometheus_text():
+    lines = list()
+    with _lock:
+        for stage, values in sorted(_samples.items()):
+            values = np.asarray(values, dtype=np.float64)
+            name = _metric_name('stage_seconds')
+            for bound in HISTOGRAM_BUCKETS:
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(
+                    f'{name}_bucket{{stage="{stage}",le="{le}"}} '
+                    f'{int((values <= bound).sum())}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {values.sum()}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {len(values)}')
+        for kind, values in (
+                ('total', _counters.items()),
+                ('', _gauges.items())):
+            for (name, labels), value in sorted(values):
+                name = _metric_name(f'{name}_{kind}' if kind else name)
+                lines.append(
+                    f'{name}{{{_format_labels(labels)}}} {value}'
+                    if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+# written to a temp file and renamed, so collectors never read half a file
+def export(path=METRICS_PATH, elapsed=None):
+    if not path:
+        return
+    text = prometheus_text() \
+        if path.endswith('.prom') \
+        else json.dumps(snapshot(elapsed), indent=4)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+# writes a snapshot every interval until stopped, and once more on stop
+class Exporter:
+    def __init__(self, path=METRICS_PATH, interval=METRICS_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        if self.path:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            export(self.path, self.elapsed())
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        export(self.path, self.elapsed())
@@ -1,26 +1,14 @@
-import sc2reader
+from overmind.replay_loader import load_replay
+from overmind.timeseries import player_stats_array
+import numpy as np
 
 TEST_REPLAY = '/media/bulk/sc2/releases/HomeStory/2020/1/Stay at HSC Replay Pack/Day 2/Group C/Serral vs. Elazer/Zen.SC2Replay'
-
-filtered_events = {
-    PlayerSetupEvent,
-    CameraEvent,
-    GetControlGroupEvent,
-    SetControlGroupEvent,
-    ChatEvent,
-}
+PLAYER_STATS_PATH = 'player_stats.npy'
 
 
 def main():
-    is_past_setup = False
-    replay = sc2reader.load_replay(TEST_REPLAY, load_map=True)
-    replay.load_map()
-    with open('log.txt', 'w') as file:
-        for event in replay.tracker_events:
-            is_past_setup = is_past_setup or isinstance(event, PlayerStatsEvent)
-            if not is_past_setup or type(event) in filtered_events:
-                continue
-            file.write(f'{event}\n')
-
+    replay = load_replay(TEST_REPLAY, 'stats')
+    pids, array = player_stats_array(replay.tracker_events)
+    np.save(PLAYER_STATS_PATH, array, allow_pickle=False)
+    print(f'{pids}    {array.shape}    {PLAYER_STATS_PATH}')
     return 0
-
@@ -3,32 +3,42 @@ from pathlib import Path
 import string
 import json
 import difflib
-from functools import partial, reduce
+from functools import partial, reduce, lru_cache
 from itertools import (
-    product, repeat, chain, combinations,
-    starmap, dropwhile, count, islice)
-from operator import xor, eq, ne, itemgetter, lt
+    product, chain, combinations, starmap, dropwhile, islice)
+from operator import xor, eq, ne, lt
 import time
-from overmind import bnet_api
-from overmind.database import Session
-from overmind.database.models import (
-    BattleNetInfo, Player, Team, Race,
-    Map, Replay)
+from overmind import bnet_api, timeseries, replay_loader, metrics
+from overmind.timeseries import (
+    player_stats_array, unit_events_array, PLAYER_STATS_FIELDS)
+from overmind.database import unit_of_work
+from overmind.database.models import Race
 from overmind.database.queries import (
-    get_battle_net_info_by_locator,
-    get_player_by_pro_name,
-    get_team_by_clan_tag,
-    get_map_by_file_hash,
-    get_replay_by_file_hash,
-    get_replay_data_path)
+    get_replay_data_path,
+    get_replay_file_hashes)
+from overmind.database.resolver import Resolver
+from .records import (
+    PlayerRecord, PlayerStatsRecord, ReplayRecord)
+from .writer import BatchWriter
+from .discovery import scan_replays
+from .manifest import (
+    Manifest, format_failure_counts, IMPORTED, REJECTED, FAILED)
+from .store import ReplayStore
+from .maps import map_cache
+from collections import deque
 from datetime import datetime, timedelta
-import shutil
-from multiprocessing.pool import ThreadPool
+from io import BytesIO
+import dataclasses
+import hashlib
+import os
+import pickle
+from multiprocessing import Pool
+from sc2reader import __version__ as sc2reader_version
+from sc2reader.exceptions import MPQError, ReadError
 import dotenv
 
 dotenv.load_dotenv()
 
-import sc2reader
 
 SOURCE_PATH = '/media/bulk/sc2/ggtracker/'
 SC2REPLAY_EXTENTION_GLOB = '*.[Ss][Cc]2[Rr][Ee][Pp][Ll][Aa][Yy]'
@@ -36,11 +46,26 @@ PLAYER_SET_PATH = 'player_set.txt'
 BARCODE_REPORT_PATH = '_barcode_report.json'
 PLAYER_ALIAS_MAP_PATH = 'player_alias_map.json'
 NOT_LABELD_REPORT_PATH = 'not_labeled.txt'
-
-_replay_data_path_session, _replay_data_path = \
-    get_replay_data_path(None)
-_replay_data_path_session.close()
-_replay_data_path = Path(_replay_data_path)
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', os.cpu_count()))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_RETRY_FAILED = bool(int(os.environ.get('IMPORT_RETRY_FAILED', 0)))
+IMPORT_PLAYER_STATS = bool(int(os.environ.get('IMPORT_PLAYER_STATS', 1)))
+# staged pipeline with async ladder lookups, see pipeline.py. 0 falls back
+# to the pool of workers that each do every step.
+IMPORT_PIPELINE = bool(int(os.environ.get('IMPORT_PIPELINE', 1)))
+# paths handed to the pool ahead of the results read back, per worker
+IMPORT_POOL_AHEAD = int(os.environ.get('IMPORT_POOL_AHEAD', 2))
+# tracker events first shipped with 2.0.8
+IMPORT_MIN_BASE_BUILD = int(os.environ.get('IMPORT_MIN_BASE_BUILD', 25446))
+# bump whenever a change could let a replay through that was rejected
+# before; rejections recorded under another version are retried
+IMPORTER_VERSION = 1
+# rejections that depend on the path label and the alias map rather than
+# the file: a copy under another path may match, so they are only ever
+# recorded per path, and retried when the alias map changes
+PATH_LABEL_REASONS = frozenset(('unmatched_players',))
+
+_replay_store = None
 
 
 _remove_re = re.compile(
@@ -58,9 +83,17 @@ _players_re = re.compile(
     r'(?P<player_2>[0-9A-Za-z\?]{2,}(?: \([PTZ]\))?)',
     re.I)
 
+_nonprintable_re = re.compile(
+    f'[^{re.escape(string.printable)}]')
+
 _barcode_map = dict()
 _player_alias_map = dict()
 _player_alias_inverse_map = dict()
+_player_alias_map_digest = None
+# file_hash -> reason, replays rejected before under the current version
+_known_rejections = dict()
+_replay_file_hashes = set()
+_resolver = Resolver()
 
 def camel_to_snake(s):
     return ''.join([
@@ -68,14 +101,15 @@ def camel_to_snake(s):
         for c in s ]).lstrip('_')
 
 def normalize_text(text):
-    return ''.join(filter(
-        lambda c: c in string.printable,
+    return _nonprintable_re.sub('',
         _remove_re.sub('', 
             text \
                 .replace('&lt;', '[') \
                 .replace('&gt;', ']') \
-                .strip('?'))))
+                .strip('?')))
 
+# cached per process, cleared whenever the alias map is reloaded
+@lru_cache(maxsize=None)
 def format_player_name(text, resolve_alias=True):
     text = text.lstrip('?').lower()
     return _player_alias_inverse_map[text] \
@@ -103,12 +137,10 @@ def replace_barcode(text):
 def transform_path_name(text):
     return replace_barcode(normalize_text(text))
 
-def parse_players_from_path(path):
-    players = _players_re.search(
-        transform_path_name(path.name))
-    if not players:
-        players = _players_re.search(
-            transform_path_name(path.parent.name))
+# replay packs repeat the same "x vs y" directory names thousands of times
+@lru_cache(maxsize=1 << 14)
+def parse_players_from_name(name):
+    players = _players_re.search(transform_path_name(name))
     if not players:
         return None
     return tuple(zip(
@@ -117,15 +149,22 @@ def parse_players_from_path(path):
             format_player_name,
             players.groups()))))
 
+def parse_players_from_path(path):
+    players = parse_players_from_name(path.name)
+    if not players:
+        players = parse_players_from_name(path.parent.name)
+    return players
+
 def process_path(path):
     return parse_players_from_path(path)
 
 def walk_paths(path):
-    return Path(path).rglob(SC2REPLAY_EXTENTION_GLOB)
+    return scan_replays(path)
 
 def load_player_alias_map(path):
     global _player_alias_map
     global _player_alias_inverse_map
+    global _player_alias_map_digest
     with open(path, 'r') as file:
         _player_alias_map = json.load(file)
         _player_alias_inverse_map = {
@@ -133,34 +172,120 @@ def load_player_alias_map(path):
             for player, values in _player_alias_map.items()
             for alias in values
         }
+    _player_alias_map_digest = hashlib.sha256(
+        json.dumps(_player_alias_map, sort_keys=True).encode()) \
+        .hexdigest()[:16]
+    format_player_name.cache_clear()
+    parse_players_from_name.cache_clear()
+    _match_order.cache_clear()
     return _player_alias_map
 
-def load_replay(path, load_level=4, only_1v1=True):
-    replay = sc2reader.load_replay(
-        str(path), 
-        load_level=load_level)
-    return replay \
-        if not only_1v1 or replay.type == '1v1' \
-        else None
-
+# resolved on first use; import_paths resolves it before forking so workers
+# inherit the path instead of each querying for it
+def replay_store():
+    global _replay_store
+    if _replay_store:
+        return _replay_store
+    with unit_of_work():
+        _, replay_data_path = get_replay_data_path(None)
+    _replay_store = ReplayStore(Path(replay_data_path))
+    return _replay_store
+
+def load_replay_file_hashes():
+    global _replay_file_hashes
+    with unit_of_work():
+        _, _replay_file_hashes = get_replay_file_hashes(None)
+    return _replay_file_hashes
+
+def rejection_version(reason):
+    version = f'{IMPORTER_VERSION}/{sc2reader_version}'
+    return f'{version}/{_player_alias_map_digest}' \
+        if reason in PATH_LABEL_REASONS \
+        else version
+
+def load_known_rejections(manifest):
+    global _known_rejections
+    _known_rejections = manifest.known_rejections()
+    return _known_rejections
+
+def load_resolver():
+    with unit_of_work() as session:
+        _resolver.preload(session)
+    return _resolver
+
+# the one read of a replay file: hashed, parsed and stored from this buffer
+def read_replay_file(path):
+    with metrics.timer('read'):
+        with open(path, 'rb') as file:
+            data = file.read()
+    metrics.count('replay_bytes_read', len(data))
+    return data
+
+def hash_replay_data(data):
+    return hashlib.sha256(data).digest()
+
+# BytesIO shares the buffer of the bytes it wraps until written to
+def _replay_source(path, data):
+    if data is None:
+        return str(path)
+    source = BytesIO(data)
+    source.name = str(path)
+    return source
+
+# raised for replays the importer will never take, recorded in the
+# manifest with the reason instead of being retried
+class ReplayRejected(Exception):
+    @property
+    def reason(self):
+        return self.args[0]
+
+    # set once the file has been hashed
+    @property
+    def file_hash(self):
+        return self.args[1] if len(self.args) > 1 else None
+
+def rejection_reason(replay):
+    if replay.base_build < IMPORT_MIN_BASE_BUILD or not replay.datapack:
+        return 'unsupported_build'
+    if replay.type != '1v1':
+        return 'not_1v1'
+    details = replay.raw_data.get('replay.details') \
+        or replay.raw_data.get('replay.details.backup') \
+        or {}
+    if len(details.get('players', ())) != 2:
+        return 'player_count'
+    return None
+
+# header and details only, so team games, arcade games and broken files
+# are turned away before the tracker events are decoded
+def prefilter_replay(path, data=None):
+    try:
+        replay = replay_loader.load_replay(
+            _replay_source(path, data), 'details')
+    except (MPQError, ReadError) as e:
+        raise ReplayRejected('unreadable') from e
+    reason = rejection_reason(replay)
+    if reason:
+        raise ReplayRejected(reason)
+    return replay
+
+@lru_cache(maxsize=1 << 16)
 def string_simularity(left, right):
-    return difflib.SequenceMatcher(None, left, right).ratio()
-
-def match_replay_player_names(replay, players):
-    if not players:
-        return {
-            (x.name, x.name.lower()): x
-            for x in replay.players
-        }
-    order = players, tuple( x.name for x in replay.players )
+    if left == right:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, left, right)
+    return matcher.ratio()
+
+# the decision only depends on the labels and in-game names, so it is
+# computed once per distinct pair and replayed from the cache afterwards
+@lru_cache(maxsize=1 << 14)
+def _match_order(players, names):
     ratios = tuple(
         tuple( tuple(map(partial(string_simularity, h), s))
                 for h, s in m )
         for m in (
             zip((n, format_player_name(n)), zip(*players))
-            for n in order[1] ) )
-    def order_result(swap):
-        return dict(zip(order[0], replay.players[::1-(int(swap)*2)]))
+            for n in names ) )
     def iter_ratios():
         return product((0, 1), repeat=3)
     # take highest value >= 0.6
@@ -168,10 +293,21 @@ def match_replay_player_names(replay, players):
         return None
     if all(starmap(eq, combinations(chain(*chain(*ratios)), 2))):
         return None
-    return order_result(reduce(xor, reduce(
+    return reduce(xor, reduce(
         lambda a, s: s if s[0] > a[0] else a, 
         ( (ratios[i][j][k], i, k) 
-            for i, j, k in iter_ratios() ))[1:]))
+            for i, j, k in iter_ratios() ))[1:])
+
+def match_replay_player_names(replay, players):
+    if not players:
+        return {
+            (x.name, x.name.lower()): x
+            for x in replay.players
+        }
+    swap = _match_order(players, tuple( x.name for x in replay.players ))
+    if swap is None:
+        return None
+    return dict(zip(players, replay.players[::1-(int(swap)*2)]))
 
 def ladder_stats_to_locator(ladder_stats):
     return (
@@ -180,45 +316,30 @@ def ladder_stats_to_locator(ladder_stats):
         ladder_stats['id']) \
         if ladder_stats else None
 
-def replay_to_map_info(replay, _session=None):
-    #global _session
-    _session, map_info = get_map_by_file_hash(_session, bytes.fromhex(replay.map_hash))
-    if map_info:
-        return _session, map_info
-    replay.load_map()
-    map_info = Map(
-        file_hash=bytes.fromhex(replay.map.filehash),
-        map_name=replay.map.name,
-        width=replay.map.map_info.width,
-        height=replay.map.map_info.height,
-        tile_set=replay.map.map_info.tile_set,
-        camera_top=replay.map.map_info.camera_top,
-        camera_left=replay.map.map_info.camera_left,
-        camera_bottom=replay.map.map_info.camera_bottom,
-        camera_right=replay.map.map_info.camera_right)
-    _session.add(map_info)
-    return _session, map_info
-
-def replay_to_replay_info(replay, map_info, bnet_infos, path, _session=None):
-    #global _session
-    _session, replay_info = get_replay_by_file_hash(_session, bytes.fromhex(replay.filehash))
-    if replay_info:
-        return _session, replay_info
-    def select_winner():
-        winner_data = replay.winner.players[0].detail_data['bnet']
-        return next(dropwhile(
-            lambda x: x[1] != (
-                winner_data['region'],
-                winner_data['subregion'],
-                winner_data['uid']),
-            ( (bnet_info, (bnet_info.region, bnet_info.realm, bnet_info.profile_id))
-                for bnet_info in bnet_infos )))[0]
-    replay = Replay(
-        file_hash=bytes.fromhex(replay.filehash),
+# from the local map cache, the depot is only asked for maps it hasn't seen
+def replay_to_map_record(replay):
+    return map_cache().replay_record(replay)
+
+def replay_to_player_stats_record(replay):
+    if not replay.tracker_events:
+        return None
+    pids, array = player_stats_array(replay.tracker_events)
+    return PlayerStatsRecord(
+        pids=pids,
+        fields=PLAYER_STATS_FIELDS,
+        player_stats=timeseries.to_bytes(array),
+        unit_events=timeseries.to_bytes(
+            unit_events_array(replay.tracker_events)))
+
+def replay_to_replay_record(replay, file_hash, path, map_record, players):
+    winner_data = replay.winner.players[0].detail_data['bnet']
+    return ReplayRecord(
+        file_hash=file_hash,
         original_path=bytes(path),
         versions=replay.versions,
         category=replay.category,
-        map=map_info,
+        map_hash=bytes.fromhex(replay.map_hash),
+        map=map_record,
         start_time=replay.start_time + timedelta(hours=replay.time_zone),
         end_time=replay.end_time + timedelta(hours=replay.time_zone),
         real_length=timedelta(seconds=replay.real_length.seconds),
@@ -230,51 +351,31 @@ def replay_to_replay_info(replay, map_info, bnet_infos, path, _session=None):
         is_private=replay.is_private,
         speed=replay.speed,
         region=replay.region,
-        winner=select_winner(),
-        battle_net_infos=bnet_infos)
-    _session.add(replay)
-    return _session, replay
-
-def ladder_stats_to_battle_net_info(
-    display_name, clan_tag, locator, ladder_stats, 
-    pro_name=None, _session=None):
-    #global _session
-    _session, bnet_info = get_battle_net_info_by_locator(_session, *locator)
-    if bnet_info:
-        return _session, bnet_info 
-    player = None
-    if pro_name:
-        _session, player = get_player_by_pro_name(_session, pro_name)
-    if not player:
-        player = Player(pro_name=pro_name)
-        _session.add(player)
-    # team should be updated manually/from liquipedia
-    bnet_info = tuple(filter(
-        partial(eq, locator[2]), ( 
-            bnetinfo.profile_id 
-            for bnetinfo in player.battle_net_infos )))
-    if bnet_info:
-        return _session, bnet_info[0]
-    bnet_info = BattleNetInfo(
-        player=player, **{
-            camel_to_snake(key) 
-                if key != 'id' 
-                else 'profile_id': Race[value.upper()]
-                    if key == 'favoriteRace'
-                    else datetime.fromtimestamp(value)
-                    if key == 'joinTimestamp'
-                    else int(value)
-                    if key == 'id'
-                    else value
-            for key, value in ladder_stats.items() })
-    if not bnet_info.display_name:
-        bnet_info.display_name = display_name
-    if not bnet_info.clan_tag:
-        bnet_info.clan_tag = clan_tag
-    _session.add(bnet_info)
-    #session.commit()
-    return _session, bnet_info
-        
+        winner_locator=(
+            winner_data['region'],
+            winner_data['subregion'],
+            winner_data['uid']),
+        players=players,
+        player_stats=replay_to_player_stats_record(replay))
+
+def ladder_stats_to_battle_net_info_columns(
+    display_name, clan_tag, ladder_stats):
+    columns = {
+        camel_to_snake(key) 
+            if key != 'id' 
+            else 'profile_id': Race[value.upper()]
+                if key == 'favoriteRace'
+                else datetime.fromtimestamp(value)
+                if key == 'joinTimestamp'
+                else int(value)
+                if key == 'id'
+                else value
+        for key, value in ladder_stats.items() }
+    if not columns.get('display_name'):
+        columns['display_name'] = display_name
+    if not columns.get('clan_tag'):
+        columns['clan_tag'] = clan_tag
+    return columns
 
 def player_to_locator(replay, player):
     return \
@@ -288,81 +389,223 @@ def clan_tag_from_replay(display_name, replay):
         ( player.name for player in replay.players ))) \
         .name
 
-def import_with_path_label(path, assume_pro=False):
-    _stopwatch = time.time_ns()
-    _session = Session()
-    not_labeled = list()
-    replay = load_replay(path, load_level=2)
-    if not replay:
-        _session.close()
-        mark = time.time_ns() - _stopwatch
-        return mark / (10**9), None
-    players = parse_players_from_path(path)
-    #if not players:
-    #    #not_labeled.append(path)
-    #    _session.close()
-    #    mark = time.time_ns() - _stopwatch
-    #    return mark / (10**9), None
-    match = match_replay_player_names(replay, players)
+def _ladder_stats(locator):
+    with metrics.timer('ladder_lookup'):
+        return bnet_api.get_showcased_ladder_stats(*locator)
+
+def _store_replay(file_hash, path, data=None):
+    with metrics.timer('file_copy'):
+        return replay_store().put(file_hash, path, data)
+
+# runs in worker processes: no database or network access. returns the
+# record with battle_net_info left empty, or None if the file is known.
+def parse_with_path_label(path, data=None):
+    data = read_replay_file(path) if data is None else data
+    with metrics.timer('hash'):
+        file_hash = hash_replay_data(data)
+    if file_hash in _replay_file_hashes:
+        return file_hash, None
+    if file_hash in _known_rejections:
+        metrics.count('known_rejection')
+        raise ReplayRejected(_known_rejections[file_hash], file_hash)
+    try:
+        return file_hash, _parse_replay_record(path, data, file_hash)
+    except ReplayRejected as e:
+        raise ReplayRejected(e.reason, file_hash) from e
+
+def _parse_replay_record(path, data, file_hash):
+    with metrics.timer('parse'):
+        replay = replay_loader.finish_load(
+            prefilter_replay(path, data),
+            'import_stats' if IMPORT_PLAYER_STATS else 'import')
+    with metrics.timer('name_match'):
+        players = parse_players_from_path(path)
+        match = match_replay_player_names(replay, players)
     if not match:
-        _session.close()
-        mark = time.time_ns() - _stopwatch
-        return mark / (10**9), None
-    bnet_infos = tuple(
-        ladder_stats_to_battle_net_info(
-            player.name,
-            player.clan_tag,
-            player_to_locator(replay, player),
-            bnet_api.get_showcased_ladder_stats(
-                *player_to_locator(replay, player)),
-            pro_name,
-            _session=_session)
+        raise ReplayRejected('unmatched_players')
+    players = tuple(
+        PlayerRecord(
+            display_name=player.name,
+            clan_tag=player.clan_tag,
+            locator=player_to_locator(replay, player),
+            battle_net_info=None,
+            pro_name=pro_name,
+            race=player.play_race.lower() if player.play_race else None)
         for (_, pro_name), player in match.items() )
-    _session = bnet_infos[-1][0]
-    _session, map_info = replay_to_map_info(replay, _session=_session)
-    _session, replay_info = replay_to_replay_info(
-        replay,
-        map_info,
-        tuple(map(itemgetter(1), bnet_infos)),
-        path,
-        _session=_session)
-
-    copy_path = _replay_data_path / f'{replay.filehash}.SC2Replay'
-    if not copy_path.exists():
-        shutil.copy(path, copy_path)
-    
+    map_record = replay_to_map_record(replay) \
+        if ('maps', bytes.fromhex(replay.map_hash)) not in _resolver \
+        else None
+    return replay_to_replay_record(
+        replay, file_hash, path, map_record, players)
+
+# ladder_stats in the same order as record.players
+def with_ladder_stats(record, ladder_stats):
+    return dataclasses.replace(record, players=tuple(
+        dataclasses.replace(player,
+            battle_net_info=ladder_stats_to_battle_net_info_columns(
+                player.display_name,
+                player.clan_tag,
+                stats))
+        for player, stats in zip(record.players, ladder_stats) ))
+
+# runs in worker processes: no database access, returns plain records
+def extract_with_path_label(path):
+    _stopwatch = time.time_ns()
+    data = read_replay_file(path)
+    file_hash, record = parse_with_path_label(path, data)
+    if record:
+        record = with_ladder_stats(record, [
+            _ladder_stats(player.locator) for player in record.players ])
+    copy_path = _store_replay(file_hash, path, data)
     mark = time.time_ns() - _stopwatch
-    _session.commit()
-    _session.close()
-    #print(f'{next(_counter)}    {mark / (10**9)}    {normalize_text(str(path))}')
-    return mark / (10**9), copy_path
+    if record:
+        metrics.record('extract', mark / (10**9))
+    return mark / (10**9), record, copy_path
+
+def _register_written_record(record):
+    _replay_file_hashes.add(record.file_hash)
 
-def _import_with_path_label_thread(counter_and_path):
+def import_with_path_label(path, assume_pro=False):
+    marktime, record, copy_path = extract_with_path_label(path)
+    if not record:
+        return marktime, copy_path
+    writer = BatchWriter(1,
+        on_written=_register_written_record,
+        resolver=_resolver)
+    (_, exception, flushtime), = writer.add(None, record)
+    if exception:
+        raise exception
+    return marktime + flushtime, copy_path
+
+def _portable_exception(e):
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return Exception(f'{type(e).__name__}: {e}')
+
+# stage timings recorded in the worker ride along with each result
+def _extract_with_path_label_process(counter_and_path):
     counter, path = counter_and_path
     try:
-        result = (counter, None, path, import_with_path_label(path))
-        return result
+        result = extract_with_path_label(path)
+        return counter, None, path, result, metrics.drain()
     except KeyboardInterrupt:
-        return counter, KeyboardInterrupt, path, (None, None)
-    #except AssertionError as e:
+        return counter, KeyboardInterrupt(), path, \
+            (None, None, None), metrics.drain()
     except Exception as e:
-        return counter, e, path, (None, None)
-
-
-def main():
+        return counter, _portable_exception(e), path, \
+            (None, None, None), metrics.drain()
+
+def _init_import_process(player_alias_map_path, bnet_cache_counters):
+    # connections inherited from the parent must not be shared
+    bnet_api.close()
+    bnet_api.cache.use_counters(bnet_cache_counters)
+    load_player_alias_map(player_alias_map_path)
+
+def _written_results(written):
+    for (counter, path, marktime, copy_path), exception, flushtime in written:
+        if exception:
+            yield counter, exception, path, (None, None)
+            continue
+        yield counter, None, path, (marktime + flushtime, copy_path)
+
+def _count_result(exception, copy_path):
+    if copy_path:
+        metrics.count('imported')
+    elif isinstance(exception, ReplayRejected):
+        metrics.count('rejected', reason=exception.reason)
+    elif exception:
+        metrics.count('failed', error=type(exception).__name__)
+
+def _import_paths(paths, workers, batch_size):
+    replay_store()
+    writer = BatchWriter(batch_size,
+        on_written=_register_written_record,
+        resolver=_resolver)
+    paths = iter(paths)
+    pending = deque()
+    with Pool(
+        workers,
+        initializer=_init_import_process,
+        initargs=(
+            PLAYER_ALIAS_MAP_PATH,
+            bnet_api.cache.counters())) as pool:
+        # a bounded window rather than pool.imap, which drains the paths
+        # into its task queue as fast as discovery yields them
+        while True:
+            for item in islice(paths, workers * IMPORT_POOL_AHEAD
+                    - len(pending)):
+                pending.append(pool.apply_async(
+                    _extract_with_path_label_process, (item,)))
+            if not pending:
+                break
+            counter, exception, path, result, measured = \
+                pending.popleft().get()
+            metrics.merge(measured)
+            metrics.gauge('in_flight', len(pending))
+            marktime, record, copy_path = result
+            if exception or not record:
+                yield counter, exception, path, (marktime, copy_path)
+                continue
+            yield from _written_results(writer.add(
+                (counter, path, marktime, copy_path), record))
+            metrics.gauge('writer_pending', len(writer))
+    yield from _written_results(writer.flush())
+
+def import_paths(paths, workers=IMPORT_WORKERS, batch_size=IMPORT_BATCH_SIZE):
+    for result in _import_paths(paths, workers, batch_size):
+        _, exception, _, (_, copy_path) = result
+        _count_result(exception, copy_path)
+        yield result
+
+def record_result(manifest, exception, path, marktime, copy_path):
+    if copy_path:
+        manifest.record(path, IMPORTED,
+            file_hash=bytes.fromhex(copy_path.stem),
+            elapsed=marktime)
+    elif isinstance(exception, ReplayRejected):
+        manifest.record(path, REJECTED,
+            file_hash=exception.file_hash,
+            reason=exception.reason)
+    elif exception:
+        manifest.record(path, FAILED, exception=exception)
+    else:
+        manifest.record(path, REJECTED, elapsed=marktime)
+
+def main(
+    workers=IMPORT_WORKERS,
+    batch_size=IMPORT_BATCH_SIZE,
+    retry_failed=IMPORT_RETRY_FAILED):
     load_player_alias_map(PLAYER_ALIAS_MAP_PATH)
-    paths = list(map(tuple, enumerate(walk_paths(SOURCE_PATH))))
-    with open('not_imported.txt', 'a') as file:
-        results = ThreadPool(32).imap(
-            _import_with_path_label_thread,
-            paths)
+    load_replay_file_hashes()
+    load_resolver()
+    with Manifest(
+            rejection_version=rejection_version,
+            path_reasons=PATH_LABEL_REASONS) as manifest, \
+        metrics.Exporter() as exporter, \
+        open('not_imported.txt', 'a') as file:
+        load_known_rejections(manifest)
+        paths = enumerate(
+            path for path in walk_paths(SOURCE_PATH)
+            if not manifest.is_done(path, retry_failed) )
+        if IMPORT_PIPELINE:
+            from . import pipeline
+            results = pipeline.import_paths(paths, workers, batch_size)
+        else:
+            results = import_paths(paths, workers, batch_size)
         for counter, exception, path, (marktime, copy_path) in results:
             if isinstance(exception, KeyboardInterrupt):
                 exit(-1)
+            record_result(manifest, exception, path, marktime, copy_path)
             if copy_path:
                 print(f'{counter}    {marktime}    {normalize_text(str(path))}')
                 continue
             file.write(f'{normalize_text(str(path))}\n')
+        print(format_failure_counts(manifest.failure_counts()))
+        print(metrics.format_summary(
+            metrics.summary(elapsed=exporter.elapsed())))
+        print(metrics.format_counters())
         #for path in paths[3060:3071]:
         #    try:
         #        copy_path = import_with_path_label(path)
@@ -394,5 +637,9 @@ def main():
     #with open(NOT_LABELD_REPORT_PATH, 'w') as file:
     #    for path in not_labeled:
     #        file.write(f'{path}\n')
+    bnet_cache_stats = bnet_api.cache.stats()
+    print(
+        f'bnet cache    {bnet_cache_stats["hits"]} hits    '
+        f'{bnet_cache_stats["misses"]} misses')
     return 0
 
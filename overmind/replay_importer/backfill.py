@@ -0,0 +1,110 @@
+from overmind import replay_loader, timeseries
+from overmind.database import unit_of_work
+from overmind.database.models import Race
+from overmind.database.queries import (
+    get_associations_without_race,
+    set_association_races,
+    get_replay_stats_file_hashes_by_race,
+    set_replay_stats_unit_events,
+    rebuild_win_loss_cube)
+from . import replay_store, player_to_locator
+from itertools import groupby
+from operator import itemgetter
+from sc2reader.exceptions import MPQError, ReadError
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE', 500))
+
+def _races(path):
+    replay = replay_loader.load_replay(str(path), 'import')
+    return { player_to_locator(replay, player):
+            Race(player.play_race.lower())
+        for player in replay.players
+        if player.play_race }
+
+# races of associations written before they were recorded, read back out
+# of the stored copies at the details level
+def backfill_races(batch_size=BACKFILL_BATCH_SIZE):
+    store = replay_store()
+    with unit_of_work() as session:
+        _, associations = get_associations_without_race(session)
+    counts = dict.fromkeys(( 'updated', 'missing', 'unreadable' ), 0)
+    rows = list()
+    for file_hash, group in groupby(associations, itemgetter(0)):
+        group = list(group)
+        path = store.find(file_hash)
+        if not path:
+            counts['missing'] += len(group)
+            continue
+        try:
+            races = _races(path)
+        except (MPQError, ReadError):
+            counts['unreadable'] += len(group)
+            continue
+        for _, locator, battle_net_info_id, replay_id in group:
+            if locator not in races:
+                counts['missing'] += 1
+                continue
+            rows.append({
+                'battle_net_info_id': battle_net_info_id,
+                'replay_id': replay_id,
+                'race': races[locator] })
+        if len(rows) >= batch_size:
+            with unit_of_work() as session:
+                set_association_races(session, rows)
+            counts['updated'] += len(rows)
+            rows = list()
+    with unit_of_work() as session:
+        set_association_races(session, rows)
+        counts['updated'] += len(rows)
+        rebuild_win_loss_cube(session)
+    return counts
+
+def _unit_events(path):
+    replay = replay_loader.load_replay(str(path), 'stats')
+    return timeseries.to_bytes(
+        timeseries.unit_events_array(replay.tracker_events))
+
+# unit events stored before warp-ins were counted as made when they
+# finished. only protoss replays had any.
+def backfill_unit_events(batch_size=BACKFILL_BATCH_SIZE):
+    store = replay_store()
+    with unit_of_work() as session:
+        _, file_hashes = get_replay_stats_file_hashes_by_race(
+            session, Race.PROTOSS)
+    counts = dict.fromkeys(( 'updated', 'missing', 'unreadable' ), 0)
+    rows = list()
+    for file_hash in file_hashes:
+        path = store.find(file_hash)
+        if not path:
+            counts['missing'] += 1
+            continue
+        try:
+            unit_events = _unit_events(path)
+        except (MPQError, ReadError):
+            counts['unreadable'] += 1
+            continue
+        rows.append({ 'file_hash': file_hash, 'unit_events': unit_events })
+        if len(rows) >= batch_size:
+            with unit_of_work() as session:
+                set_replay_stats_unit_events(session, rows)
+            counts['updated'] += len(rows)
+            rows = list()
+    with unit_of_work() as session:
+        set_replay_stats_unit_events(session, rows)
+        counts['updated'] += len(rows)
+    return counts
+
+def main():
+    for name, total in backfill_races().items():
+        print(f'{name:<12}{total}')
+    # after the races, which it finds protoss replays by
+    for name, total in backfill_unit_events().items():
+        print(f'unit events {name:<12}{total}')
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,82 @@
+from pathlib import Path
+from queue import Queue, Full
+from threading import Thread, Event, Lock
+from overmind import metrics
+import os
+
+SC2REPLAY_EXTENSION = '.sc2replay'
+DISCOVERY_THREADS = int(os.environ.get('DISCOVERY_THREADS', 8))
+DISCOVERY_QUEUE_SIZE = int(os.environ.get('DISCOVERY_QUEUE_SIZE', 1024))
+
+_done = object()
+
+# yields replay paths while the tree is still being walked. directories are
+# scanned by a pool of threads; the bounded queue keeps them from running
+# ahead of the consumer.
+def scan_replays(
+    root,
+    threads=DISCOVERY_THREADS,
+    maxsize=DISCOVERY_QUEUE_SIZE):
+    directories = Queue()
+    paths = Queue(maxsize)
+    stop = Event()
+    outstanding_lock = Lock()
+    outstanding = [ 1 ]
+
+    def put_path(path):
+        while not stop.is_set():
+            try:
+                paths.put(path, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def scan_directory(directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if stop.is_set():
+                    return
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        with outstanding_lock:
+                            outstanding[0] += 1
+                        directories.put(entry.path)
+                    elif entry.name.lower().endswith(SC2REPLAY_EXTENSION) \
+                        and entry.is_file():
+                        put_path(Path(entry.path))
+                except OSError:
+                    continue
+
+    def scan():
+        while True:
+            directory = directories.get()
+            if directory is None:
+                return
+            try:
+                scan_directory(directory)
+            except OSError:
+                pass
+            finally:
+                with outstanding_lock:
+                    outstanding[0] -= 1
+                    is_done = outstanding[0] == 0
+                if is_done:
+                    put_path(_done)
+
+    directories.put(os.fspath(root))
+    scanners = tuple(
+        Thread(target=scan, daemon=True)
+        for _ in range(max(1, threads)) )
+    for scanner in scanners:
+        scanner.start()
+    try:
+        while True:
+            path = paths.get()
+            metrics.gauge('discovery_queue', paths.qsize())
+            if path is _done:
+                return
+            yield path
+    finally:
+        stop.set()
+        for _ in scanners:
+            directories.put(None)
@@ -0,0 +1,169 @@
+import sqlite3
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+IMPORT_MANIFEST_PATH = os.environ.get(
+    'IMPORT_MANIFEST_PATH', 'import_manifest.sqlite')
+IMPORT_MANIFEST_COMMIT_INTERVAL = 256
+
+IMPORTED = 'imported'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+# local checkpoint of every path the importer has looked at, so reruns
+# (and runs resumed after a crash or ctrl-c) only see new or changed files.
+# rejection_version maps a rejection reason to the version of the code
+# that decides it; a rejection recorded under another version is retried.
+# path_reasons are rejections that depend on the path, not the contents,
+# and are kept out of the rejections by content.
+class Manifest:
+    def __init__(
+        self,
+        path=IMPORT_MANIFEST_PATH,
+        rejection_version=None,
+        path_reasons=frozenset()):
+        self.path = path
+        self.rejection_version = rejection_version
+        self.path_reasons = path_reasons
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'path BLOB PRIMARY KEY, '
+            'size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, '
+            'file_hash BLOB, '
+            'status TEXT NOT NULL, '
+            'error_class TEXT, '
+            'elapsed REAL, '
+            'updated_at REAL NOT NULL, '
+            'reason TEXT, '
+            'version TEXT)')
+        # manifests written before rejection reasons or versions were
+        # recorded
+        columns = { row[1] for row in self._connection.execute(
+            'PRAGMA table_info(entries)') }
+        for column in ('reason', 'version'):
+            if column not in columns:
+                self._connection.execute(
+                    f'ALTER TABLE entries ADD COLUMN {column} TEXT')
+        # rejections by content, so a copy of a known bad replay under
+        # another path is turned away as soon as it's hashed
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS rejections ('
+            'file_hash BLOB PRIMARY KEY, '
+            'reason TEXT NOT NULL, '
+            'version TEXT, '
+            'updated_at REAL NOT NULL)')
+        self._entries = {
+            path: (size, mtime_ns, status, reason, version)
+            for path, size, mtime_ns, status, reason, version
+            in self._connection.execute(
+                'SELECT path, size, mtime_ns, status, reason, version '
+                'FROM entries') }
+        self._uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _version(self, reason):
+        return self.rejection_version(reason) \
+            if self.rejection_version and reason \
+            else None
+
+    def is_done(self, path, retry_failed=False):
+        entry = self._entries.get(os.fsencode(path))
+        if not entry:
+            return False
+        size, mtime_ns, status, reason, version = entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return False
+        if status == REJECTED and version != self._version(reason):
+            return False
+        return status != FAILED or not retry_failed
+
+    # file_hash -> reason, for rejections still valid under the current code
+    def known_rejections(self):
+        return { file_hash: reason
+            for file_hash, reason, version in self._connection.execute(
+                'SELECT file_hash, reason, version FROM rejections')
+            if version == self._version(reason)
+                and reason not in self.path_reasons }
+
+    def record(
+        self, path, status,
+        file_hash=None, exception=None, elapsed=None, reason=None):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        path = os.fsencode(path)
+        version = self._version(reason) if status == REJECTED else None
+        now = time.time()
+        self._connection.execute(
+            'INSERT OR REPLACE INTO entries '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                file_hash,
+                status,
+                type(exception).__name__ if exception else None,
+                elapsed,
+                now,
+                reason,
+                version))
+        if status == REJECTED and file_hash and reason \
+            and reason not in self.path_reasons:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO rejections VALUES (?, ?, ?, ?)',
+                (file_hash, reason, version, now))
+        self._entries[path] = (
+            stat.st_size, stat.st_mtime_ns, status, reason, version)
+        self._uncommitted += 1
+        if self._uncommitted >= IMPORT_MANIFEST_COMMIT_INTERVAL:
+            self.commit()
+
+    # (status, reason or error class) -> paths, everything not imported
+    def failure_counts(self):
+        return { (status, category): total
+            for status, category, total in self._connection.execute(
+                'SELECT status, COALESCE(reason, error_class), count(*) '
+                'FROM entries WHERE status != ? '
+                'GROUP BY status, COALESCE(reason, error_class) '
+                'ORDER BY count(*) DESC',
+                (IMPORTED,)) }
+
+    def commit(self):
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+def format_failure_counts(counts):
+    return '\n'.join(
+        f'{status:<12}{category or "unknown":<32}{total:>8}'
+        for (status, category), total in counts.items() )
+
+def main():
+    with Manifest() as manifest:
+        print(format_failure_counts(manifest.failure_counts()))
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,167 @@
+from overmind import metrics
+from .records import MapRecord
+from sc2reader.resources import Map
+from contextlib import contextmanager
+from collections import defaultdict
+from threading import Lock
+from urllib.request import urlopen
+from pathlib import Path
+from io import BytesIO
+import dataclasses
+import hashlib
+import fcntl
+import json
+import sys
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+MAP_EXTENSION = '.s2ma'
+MAP_CACHE_PATH = os.environ.get('MAP_CACHE_PATH', 'map_cache')
+# never download from the depot, a map that isn't cached fails the replay
+MAP_CACHE_OFFLINE = bool(int(os.environ.get('MAP_CACHE_OFFLINE', 0)))
+MAP_FETCH_TIMEOUT = float(os.environ.get('MAP_FETCH_TIMEOUT', 60))
+
+_map_cache = None
+# per map hash, so threads of one process wait on a single download.
+# other processes wait on the lock file instead.
+_locks = defaultdict(Lock)
+_locks_lock = Lock()
+
+def _reset_locks():
+    global _locks
+    global _locks_lock
+    _locks, _locks_lock = defaultdict(Lock), Lock()
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+class MapUnavailable(LookupError):
+    pass
+
+def map_to_map_record(map):
+    return MapRecord(
+        file_hash=bytes.fromhex(map.filehash),
+        map_name=map.name,
+        width=map.map_info.width,
+        height=map.map_info.height,
+        tile_set=map.map_info.tile_set,
+        camera_top=map.map_info.camera_top,
+        camera_left=map.map_info.camera_left,
+        camera_bottom=map.map_info.camera_bottom,
+        camera_right=map.map_info.camera_right)
+
+# map archives by depot hash, each next to the map record parsed out of it:
+# {root}/ab/abcd....s2ma and {root}/ab/abcd....json. a replay whose map is
+# cached never opens the archive again.
+class MapCache:
+    def __init__(self, root=MAP_CACHE_PATH, offline=MAP_CACHE_OFFLINE):
+        self.root = Path(root)
+        self.offline = offline
+
+    def path_for(self, map_hash, extension=MAP_EXTENSION):
+        return self.root / map_hash[:2] / f'{map_hash}{extension}'
+
+    def get(self, map_hash):
+        try:
+            with open(self.path_for(map_hash, '.json')) as file:
+                values = json.load(file)
+        except FileNotFoundError:
+            return None
+        return MapRecord(**{
+            **values, 'file_hash': bytes.fromhex(values['file_hash']) })
+
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        try:
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+        finally:
+            temporary.unlink(missing_ok=True)
+
+    # the archive first, so a record is never there without its archive
+    def put(self, map_hash, data):
+        record = map_to_map_record(Map(BytesIO(data), map_hash=map_hash))
+        self._write(self.path_for(map_hash), data)
+        self._write(
+            self.path_for(map_hash, '.json'),
+            json.dumps({
+                **dataclasses.asdict(record),
+                'file_hash': record.file_hash.hex() }).encode())
+        return record
+
+    @contextmanager
+    def _single_flight(self, map_hash):
+        with _locks_lock:
+            lock = _locks[map_hash]
+        with lock:
+            path = self.path_for(map_hash, '.lock')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a') as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _fetch(self, map_hash, url):
+        path = self.path_for(map_hash)
+        # an archive left by a prewarm or a run from before the records
+        if path.exists():
+            return path.read_bytes()
+        if self.offline or not url:
+            raise MapUnavailable(map_hash)
+        with metrics.timer('map_fetch'):
+            with urlopen(url, timeout=MAP_FETCH_TIMEOUT) as response:
+                return response.read()
+
+    # only the first caller for a hash downloads it, the rest wait and
+    # then read what it cached
+    def record(self, map_hash, url=None):
+        record = self.get(map_hash)
+        if record:
+            metrics.count('map_cache', result='hit')
+            return record
+        with self._single_flight(map_hash):
+            record = self.get(map_hash)
+            if record:
+                metrics.count('map_cache', result='waited')
+                return record
+            metrics.count('map_cache', result='miss')
+            return self.put(map_hash, self._fetch(map_hash, url))
+
+    def replay_record(self, replay):
+        return self.record(replay.map_hash, replay.map_file.url)
+
+    # caches every .s2ma under directory, keyed by the sha256 of its bytes,
+    # which is the hash the depot serves it under
+    def prewarm(self, directory):
+        added = 0
+        for path in Path(directory).rglob(f'*{MAP_EXTENSION}'):
+            data = path.read_bytes()
+            map_hash = hashlib.sha256(data).hexdigest()
+            if self.get(map_hash):
+                continue
+            with self._single_flight(map_hash):
+                if not self.get(map_hash):
+                    self.put(map_hash, data)
+                    added += 1
+        return added
+
+def map_cache():
+    global _map_cache
+    if not _map_cache:
+        _map_cache = MapCache()
+    return _map_cache
+
+def main(directories=()):
+    if not directories:
+        print('usage: python -m overmind.replay_importer.maps DIRECTORY...')
+        return 1
+    for directory in directories:
+        print(f'{directory}    {map_cache().prewarm(directory)}')
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+from overmind import bnet_api, metrics
+from overmind.bnet_api.aio import Client
+from . import (
+    parse_with_path_label, with_ladder_stats, read_replay_file,
+    _init_import_process, _portable_exception, _register_written_record,
+    _resolver, _count_result, replay_store,
+    IMPORT_WORKERS, IMPORT_BATCH_SIZE, PLAYER_ALIAS_MAP_PATH)
+from .writer import BatchWriter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Thread
+import multiprocessing
+import asyncio
+import queue
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+# replays parsed ahead of the slower stages, per parse worker
+IMPORT_PARSE_AHEAD = int(os.environ.get('IMPORT_PARSE_AHEAD', 2))
+IMPORT_LOOKUPS = int(os.environ.get('IMPORT_LOOKUPS', 32))
+IMPORT_COPY_WORKERS = int(os.environ.get('IMPORT_COPY_WORKERS', 4))
+# seconds the writer waits for a batch to fill before writing what it has
+IMPORT_BATCH_TIMEOUT = float(os.environ.get('IMPORT_BATCH_TIMEOUT', 2.0))
+IMPORT_QUEUE_SIZE = int(os.environ.get('IMPORT_QUEUE_SIZE', 256))
+
+_done = object()
+
+# runs in parse worker processes. the file is read once here; its bytes
+# only come back for the copy when the store can't link to the file.
+def _parse_process(path):
+    try:
+        data = read_replay_file(path)
+        file_hash, record = parse_with_path_label(path, data)
+        if replay_store().exists(file_hash) \
+            or replay_store().can_link(path):
+            data = None
+        return None, (file_hash, record, data), metrics.drain()
+    except KeyboardInterrupt:
+        return KeyboardInterrupt(), (None, None, None), metrics.drain()
+    except Exception as e:
+        return _portable_exception(e), (None, None, None), metrics.drain()
+
+def _write(writer, batch):
+    written = list()
+    for item, record in batch:
+        written.extend(writer.add(item, record))
+    return written + writer.flush()
+
+# one replay moving through the stages
+class _Item:
+    __slots__ = (
+        'counter', 'path', 'started', 'file_hash', 'record', 'data' )
+
+    def __init__(self, counter, path):
+        self.counter = counter
+        self.path = path
+        self.started = time.perf_counter()
+        self.file_hash = None
+        self.record = None
+        self.data = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+# parse (processes) -> ladder lookup (async) -> write (one batching
+# writer) -> copy (threads). every stage reads from a bounded queue, so a
+# slow stage holds back the ones before it instead of piling up replays
+# in memory, and throughput is set by the slowest stage alone.
+class Pipeline:
+    def __init__(
+        self,
+        workers=IMPORT_WORKERS,
+        batch_size=IMPORT_BATCH_SIZE,
+        lookups=IMPORT_LOOKUPS,
+        copy_workers=IMPORT_COPY_WORKERS,
+        queue_size=IMPORT_QUEUE_SIZE,
+        client_options=None):
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.lookups = max(1, lookups)
+        self.copy_workers = max(1, copy_workers)
+        self.queue_size = queue_size
+        self.client_options = client_options or dict()
+        # unbounded, the loop must never block on the consumer
+        self._results = queue.Queue()
+
+    def _emit(self, item, exception=None, copy_path=None):
+        result = (
+            item.counter,
+            exception,
+            item.path,
+            (item.elapsed() if not exception else None, copy_path))
+        self._results.put(result)
+
+    async def _get(self, stage, source):
+        item = await source.get()
+        metrics.gauge('queue', source.qsize(), stage=stage)
+        return item
+
+    async def _feed(self, paths, parse):
+        loop = asyncio.get_running_loop()
+        paths = iter(paths)
+        while True:
+            # discovery blocks on the file system, keep it off the loop
+            item = await loop.run_in_executor(None, next, paths, _done)
+            if item is _done:
+                return
+            await parse.put(_Item(*item))
+
+    async def _parse(self, executor, parse, lookup, copy):
+        loop = asyncio.get_running_loop()
+        while (item := await self._get('parse', parse)) is not _done:
+            exception, (file_hash, record, data), measured = \
+                await loop.run_in_executor(
+                    executor, _parse_process, item.path)
+            metrics.merge(measured)
+            if exception:
+                self._emit(item, exception)
+                continue
+            item.file_hash, item.record, item.data = file_hash, record, data
+            await (lookup if record else copy).put(item)
+
+    async def _lookup(self, client, lookup, write):
+        while (item := await self._get('lookup', lookup)) is not _done:
+            start = time.perf_counter()
+            try:
+                ladder_stats = await client.get_many_showcased_ladder_stats(
+                    player.locator for player in item.record.players )
+                item.record = with_ladder_stats(item.record, ladder_stats)
+            except Exception as e:
+                self._emit(item, e)
+                continue
+            metrics.record('ladder_lookup', time.perf_counter() - start)
+            await write.put(item)
+
+    async def _write(self, executor, write, copy):
+        loop = asyncio.get_running_loop()
+        writer = BatchWriter(self.batch_size,
+            on_written=_register_written_record,
+            resolver=_resolver)
+        finished = False
+        while not finished:
+            batch = list()
+            deadline = loop.time() + IMPORT_BATCH_TIMEOUT
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(
+                        self._get('write', write),
+                        max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if item is _done:
+                    finished = True
+                    break
+                batch.append((item, item.record))
+            if not batch:
+                continue
+            # the database is blocking, other stages keep going meanwhile
+            written = await loop.run_in_executor(
+                executor, _write, writer, batch)
+            for item, exception, _ in written:
+                if exception:
+                    self._emit(item, exception)
+                    continue
+                await copy.put(item)
+
+    async def _copy(self, executor, copy):
+        loop = asyncio.get_running_loop()
+        store = replay_store()
+        while (item := await self._get('copy', copy)) is not _done:
+            start = time.perf_counter()
+            try:
+                copy_path = await loop.run_in_executor(
+                    executor, store.put, item.file_hash, item.path, item.data)
+            except Exception as e:
+                self._emit(item, e)
+                continue
+            item.data = None
+            metrics.record('file_copy', time.perf_counter() - start)
+            self._emit(item, copy_path=copy_path)
+
+    # each stage is closed once everything upstream is done
+    async def _close(self, paths, parse, stages):
+        await self._feed(paths, parse)
+        for source, tasks in stages:
+            for _ in tasks:
+                await source.put(_done)
+            await asyncio.gather(*tasks)
+
+    async def _run(self, paths):
+        parse, lookup, write, copy = (
+            asyncio.Queue(self.queue_size) for _ in range(4) )
+        with ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_import_process,
+                initargs=(
+                    PLAYER_ALIAS_MAP_PATH,
+                    bnet_api.cache.counters())) as parse_executor, \
+            ThreadPoolExecutor(1) as write_executor, \
+            ThreadPoolExecutor(self.copy_workers) as copy_executor:
+            # fork every parse worker now, before discovery and the other
+            # stages start threads of their own
+            await asyncio.get_running_loop().run_in_executor(
+                parse_executor, os.getpid)
+            async with Client(**self.client_options) as client:
+                parsers = [ asyncio.ensure_future(
+                    self._parse(parse_executor, parse, lookup, copy))
+                    for _ in range(self.workers * IMPORT_PARSE_AHEAD) ]
+                lookups = [ asyncio.ensure_future(
+                    self._lookup(client, lookup, write))
+                    for _ in range(self.lookups) ]
+                writer = asyncio.ensure_future(
+                    self._write(write_executor, write, copy))
+                copiers = [ asyncio.ensure_future(
+                    self._copy(copy_executor, copy))
+                    for _ in range(self.copy_workers) ]
+                stages = (
+                    (parse, parsers),
+                    (lookup, lookups),
+                    (write, [ writer ]),
+                    (copy, copiers))
+                feeder = asyncio.ensure_future(
+                    self._close(paths, parse, stages))
+                tasks = [ feeder, *parsers, *lookups, writer, *copiers ]
+                # a stage that dies would leave the ones around it waiting
+                # on its queue forever, so the first failure stops them all
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_EXCEPTION)
+                failed = [ task for task in done
+                    if not task.cancelled() and task.exception() ]
+                if failed:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise failed[0].exception()
+
+    def _thread(self, paths):
+        try:
+            asyncio.run(self._run(paths))
+        except BaseException as e:
+            self._results.put(e)
+        finally:
+            self._results.put(_done)
+
+    # same results as import_paths: (counter, exception, path,
+    # (seconds, copy_path)), in completion order
+    def run(self, paths):
+        # resolved before the parse workers fork
+        replay_store()
+        thread = Thread(target=self._thread, args=(paths,), daemon=True)
+        thread.start()
+        while (result := self._results.get()) is not _done:
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+        thread.join()
+
+def import_paths(
+    paths,
+    workers=IMPORT_WORKERS,
+    batch_size=IMPORT_BATCH_SIZE,
+    client_options=None):
+    pipeline = Pipeline(workers, batch_size, client_options=client_options)
+    for result in pipeline.run(paths):
+        _, exception, _, (_, copy_path) = result
+        _count_result(exception, copy_path)
+        yield result
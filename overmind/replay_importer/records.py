@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+# plain, picklable results handed from parse workers to the writer
+
+@dataclass(frozen=True)
+class MapRecord:
+    file_hash: bytes
+    map_name: str
+    width: int
+    height: int
+    tile_set: str
+    camera_top: int
+    camera_left: int
+    camera_bottom: int
+    camera_right: int
+
+@dataclass(frozen=True)
+class PlayerRecord:
+    display_name: str
+    clan_tag: str
+    locator: tuple
+    battle_net_info: dict
+    pro_name: str
+    # race played, Race value
+    race: str = None
+
+@dataclass(frozen=True)
+class PlayerStatsRecord:
+    pids: tuple
+    fields: tuple
+    player_stats: bytes
+    unit_events: bytes
+
+@dataclass(frozen=True)
+class ReplayRecord:
+    file_hash: bytes
+    original_path: bytes
+    versions: list
+    category: str
+    map_hash: bytes
+    map: MapRecord
+    start_time: datetime
+    end_time: datetime
+    real_length: timedelta
+    expansion: str
+    frames: int
+    game_fps: float
+    real_type: str
+    is_ladder: bool
+    is_private: bool
+    speed: str
+    region: str
+    winner_locator: tuple
+    players: tuple
+    player_stats: PlayerStatsRecord = None
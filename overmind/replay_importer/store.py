@@ -0,0 +1,118 @@
+from pathlib import Path
+import threading
+import fcntl
+import errno
+import shutil
+import os
+
+REPLAY_EXTENSION = '.SC2Replay'
+# linux FICLONE, shares extents on btrfs/xfs instead of copying them
+_FICLONE = 0x40049409
+_cross_device_errors = frozenset((
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP,
+    errno.ENOTTY, errno.EINVAL, errno.EMLINK))
+
+def _reflink(source, destination):
+    with open(source, 'rb') as source_file, \
+        open(destination, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+
+# content addressed replay files under the replay data path, fanned out by
+# hash prefix: {root}/ab/cd/abcd....SC2Replay
+class ReplayStore:
+    def __init__(self, root, fan_out=(2, 2), link=True):
+        self.root = Path(root)
+        self.fan_out = fan_out
+        self.link = link
+
+    def path_for(self, file_hash):
+        name = file_hash.hex()
+        parts, offset = list(), 0
+        for width in self.fan_out:
+            parts.append(name[offset:offset + width])
+            offset += width
+        return self.root.joinpath(*parts, f'{name}{REPLAY_EXTENSION}')
+
+    def _flat_path_for(self, file_hash):
+        return self.root / f'{file_hash.hex()}{REPLAY_EXTENSION}'
+
+    def find(self, file_hash):
+        for path in (
+                self.path_for(file_hash),
+                self._flat_path_for(file_hash)):
+            if path.exists():
+                return path
+        return None
+
+    def exists(self, file_hash):
+        return self.path_for(file_hash).exists() \
+            or self._flat_path_for(file_hash).exists()
+
+    # a link shares the file with the source and reads nothing
+    def can_link(self, source):
+        try:
+            return self.link \
+                and os.stat(source).st_dev == os.stat(self.root).st_dev
+        except FileNotFoundError:
+            return False
+
+    # data, when given, is the content of source already read into memory
+    # and is written out instead of reading source again
+    def _place(self, source, temporary, data=None):
+        if self.link and source is not None:
+            try:
+                os.link(source, temporary)
+                return
+            except OSError as e:
+                if e.errno not in _cross_device_errors:
+                    raise
+            try:
+                _reflink(source, temporary)
+                return
+            except OSError as e:
+                if e.errno not in _cross_device_errors:
+                    raise
+                temporary.unlink(missing_ok=True)
+        if data is not None:
+            temporary.write_bytes(data)
+            return
+        shutil.copyfile(source, temporary)
+
+    def put(self, file_hash, source, data=None):
+        path = self.path_for(file_hash)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        flat_path = self._flat_path_for(file_hash)
+        if flat_path.exists():
+            os.replace(flat_path, path)
+            return path
+        # copy threads may store the same content at once
+        temporary = path.with_name(
+            f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            self._place(source, temporary, data)
+            os.replace(temporary, path)
+        finally:
+            temporary.unlink(missing_ok=True)
+        return path
+
+    def put_bytes(self, file_hash, data):
+        return self.put(file_hash, None, data)
+
+    # moves replays from the old flat layout into their fan-out directories
+    def migrate(self):
+        moved = 0
+        for entry in os.scandir(self.root):
+            name, extension = os.path.splitext(entry.name)
+            if extension != REPLAY_EXTENSION or not entry.is_file():
+                continue
+            try:
+                file_hash = bytes.fromhex(name)
+            except ValueError:
+                continue
+            path = self.path_for(file_hash)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(entry.path, path)
+            moved += 1
+        return moved
@@ -0,0 +1,252 @@
+from overmind.database import unit_of_work
+from overmind.database.models import (
+    Player, BattleNetInfo, BattleNetInfoReplayAssociation,
+    Map, Replay, ReplayStats, Race)
+from overmind.database.queries import (
+    insert_on_conflict_do_nothing,
+    get_ids_by_column,
+    get_battle_net_info_ids_by_locators,
+    increment_win_loss_cube,
+    release_from_versions)
+from overmind.database.resolver import Resolver
+from overmind import metrics
+from sqlalchemy.exc import IntegrityError, DataError
+from dataclasses import asdict
+from collections import Counter
+import time
+
+_battle_net_info_columns = frozenset(
+    BattleNetInfo.__table__.columns.keys()) - { 'id', 'player_id' }
+
+def _unique_by(key, items):
+    unique = dict()
+    for item in items:
+        unique.setdefault(key(item), item)
+    return unique
+
+def write_maps(session, records, resolver):
+    maps = _unique_by(
+        lambda x: x.file_hash,
+        ( record.map for record in records
+            if record.map
+            if ('maps', record.map.file_hash) not in resolver ))
+    session, _ = insert_on_conflict_do_nothing(session, Map,
+        map(asdict, maps.values()),
+        index_elements=[ 'file_hash' ])
+    hashes = { record.map_hash for record in records }
+    session, map_ids = get_ids_by_column(session, Map, 'file_hash',
+        hashes - resolver.resolve('maps', hashes).keys())
+    resolver.register('maps', map_ids)
+    return session, resolver.resolve('maps', hashes)
+
+def write_players(session, players, resolver):
+    pro_names = { x.pro_name for x in players if x.pro_name }
+    unknown = pro_names - resolver.resolve('players', pro_names).keys()
+    session, _ = insert_on_conflict_do_nothing(session, Player,
+        ( { 'pro_name': pro_name } for pro_name in unknown ),
+        index_elements=[ 'pro_name' ])
+    session, player_ids = get_ids_by_column(session, Player, 'pro_name',
+        unknown)
+    resolver.register('players', player_ids)
+    player_ids = resolver.resolve('players', pro_names)
+    anonymous = tuple( x for x in players if not x.pro_name )
+    session, anonymous_ids = insert_on_conflict_do_nothing(session, Player,
+        ( { 'pro_name': None } for _ in anonymous ),
+        returning=( Player.id, ))
+    return session, {
+        **{ x.locator: player_ids[x.pro_name]
+            for x in players if x.pro_name },
+        **{ x.locator: id
+            for x, (id,) in zip(anonymous, anonymous_ids) } }
+
+def write_battle_net_infos(session, records, resolver):
+    players = _unique_by(
+        lambda x: x.locator,
+        ( player for record in records for player in record.players ))
+    locators = players.keys()
+    unknown = locators - resolver.resolve('battle_net_infos', locators).keys()
+    if not unknown:
+        return session, resolver.resolve('battle_net_infos', locators)
+    # another importer may have written these since the preload
+    session, bnet_ids = get_battle_net_info_ids_by_locators(session, unknown)
+    resolver.register('battle_net_infos', bnet_ids)
+    missing = tuple(
+        players[locator] for locator in unknown
+        if locator not in bnet_ids )
+    if not missing:
+        return session, resolver.resolve('battle_net_infos', locators)
+    session, player_ids = write_players(session, missing, resolver)
+    def to_row(player):
+        region, realm, profile_id = player.locator
+        # multi-row VALUES needs the same keys in every row
+        return {
+            **{ k: player.battle_net_info.get(k)
+                for k in _battle_net_info_columns },
+            'region': region,
+            'realm': realm,
+            'profile_id': profile_id,
+            'player_id': player_ids[player.locator] }
+    session, _ = insert_on_conflict_do_nothing(session, BattleNetInfo,
+        map(to_row, missing),
+        index_elements=[ 'profile_id', 'region', 'realm' ])
+    session, missing_ids = get_battle_net_info_ids_by_locators(
+        session, ( x.locator for x in missing ))
+    resolver.register('battle_net_infos', missing_ids)
+    return session, resolver.resolve('battle_net_infos', locators)
+
+def _race(player):
+    return Race(player.race) if player.race else None
+
+# cube deltas for newly inserted replays, summed per key
+def win_loss_rows(records, map_ids):
+    totals = dict()
+    for record in records:
+        if record.real_type != '1v1' or len(record.players) != 2:
+            continue
+        for player, opponent in (record.players, record.players[::-1]):
+            if not player.race or not opponent.race:
+                continue
+            won = player.locator == record.winner_locator
+            key = (
+                _race(player),
+                _race(opponent),
+                map_ids[record.map_hash],
+                release_from_versions(record.versions),
+                record.region)
+            totals.setdefault(key, Counter()).update({
+                'wins': int(won),
+                'losses': int(not won),
+                'games': 1,
+                'seconds': record.real_length.total_seconds() })
+    return [
+        { 'race': race,
+          'opponent_race': opponent_race,
+          'map_id': map_id,
+          'release': release,
+          'region': region,
+          'wins': total['wins'],
+          'losses': total['losses'],
+          'games': total['games'],
+          'seconds': total['seconds'] }
+        for (race, opponent_race, map_id, release, region), total
+        in totals.items() ]
+
+# returns { index: exception } for records that could not be written
+def write_replay_records(session, records, resolver):
+    session, map_ids = write_maps(session, records, resolver)
+    session, bnet_ids = write_battle_net_infos(session, records, resolver)
+    failures = dict()
+    for i, record in enumerate(records):
+        if record.map_hash not in map_ids:
+            failures[i] = LookupError(
+                f'map {record.map_hash.hex()} was not extracted')
+        elif record.winner_locator not in bnet_ids:
+            failures[i] = LookupError(
+                f'winner {record.winner_locator} is not a player')
+    replays = _unique_by(
+        lambda x: x.file_hash,
+        ( record for i, record in enumerate(records)
+            if i not in failures ))
+    session, inserted = insert_on_conflict_do_nothing(session, Replay,
+        ( {
+            'file_hash': record.file_hash,
+            'original_path': record.original_path,
+            'versions': record.versions,
+            'category': record.category,
+            'map_id': map_ids[record.map_hash],
+            'start_time': record.start_time,
+            'end_time': record.end_time,
+            'real_length': record.real_length,
+            'expansion': record.expansion,
+            'frames': record.frames,
+            'game_fps': record.game_fps,
+            'real_type': record.real_type,
+            'is_ladder': record.is_ladder,
+            'is_private': record.is_private,
+            'speed': record.speed,
+            'region': record.region,
+            'winner_id': bnet_ids[record.winner_locator],
+        } for record in replays.values() ),
+        index_elements=[ 'file_hash' ],
+        returning=( Replay.id, Replay.file_hash ))
+    session, _ = insert_on_conflict_do_nothing(
+        session, BattleNetInfoReplayAssociation,
+        ( { 'battle_net_info_id': bnet_ids[player.locator],
+            'replay_id': replay_id,
+            'race': _race(player) }
+            for replay_id, file_hash in inserted
+            for player in replays[bytes(file_hash)].players ),
+        index_elements=[ 'battle_net_info_id', 'replay_id' ])
+    session, _ = insert_on_conflict_do_nothing(session, ReplayStats,
+        ( { 'file_hash': record.file_hash,
+            'pids': list(record.player_stats.pids),
+            'fields': list(record.player_stats.fields),
+            'player_stats': record.player_stats.player_stats,
+            'unit_events': record.player_stats.unit_events }
+            for _, file_hash in inserted
+            for record in ( replays[bytes(file_hash)], )
+            if record.player_stats ),
+        index_elements=[ 'file_hash' ])
+    # same transaction as the replays, so the cube never counts a replay
+    # that was rolled back or skips one that was written
+    session, _ = increment_win_loss_cube(session, win_loss_rows(
+        ( replays[bytes(file_hash)] for _, file_hash in inserted ),
+        map_ids))
+    return session, failures
+
+class BatchWriter:
+    def __init__(self, batch_size, on_written=None, resolver=None):
+        self.batch_size = max(1, batch_size)
+        self.on_written = on_written
+        self.resolver = resolver if resolver else Resolver()
+        self._pending = list()
+
+    def __len__(self):
+        return len(self._pending)
+
+    # returns (item, exception, seconds) for every record written by this call
+    def add(self, item, record):
+        self._pending.append((item, record))
+        if len(self._pending) < self.batch_size:
+            return list()
+        return self.flush()
+
+    # writes records[i] for i in indices, returns { index: exception }. a
+    # batch that a record's data fails is rolled back and halved until only
+    # the records that fail on their own are left failed. anything else,
+    # like a lost connection, would fail every half too and is raised.
+    def _write(self, records, indices):
+        try:
+            with unit_of_work() as session:
+                session, failures = write_replay_records(
+                    session, [ records[i] for i in indices ], self.resolver)
+            self.resolver.commit()
+            return { indices[i]: e for i, e in failures.items() }
+        except (IntegrityError, DataError) as e:
+            self.resolver.rollback()
+            if len(indices) == 1:
+                return { indices[0]: e }
+        except Exception:
+            self.resolver.rollback()
+            raise
+        metrics.count('db_write_retries')
+        middle = len(indices) // 2
+        return self._write(records, indices[:middle]) \
+            | self._write(records, indices[middle:])
+
+    def flush(self):
+        if not self._pending:
+            return list()
+        pending, self._pending = self._pending, list()
+        records = [ record for _, record in pending ]
+        _stopwatch = time.time_ns()
+        failures = self._write(records, range(len(records)))
+        seconds = (time.time_ns() - _stopwatch) / (10**9)
+        metrics.record('db_write', seconds)
+        mark = seconds / len(pending)
+        if self.on_written:
+            for i, record in enumerate(records):
+                if i not in failures:
+                    self.on_written(record)
+        return [ (item, failures.get(i), mark)
+            for i, (item, _) in enumerate(pending) ]
@@ -0,0 +1,55 @@
+from dataclasses import dataclass
+import sc2reader
+
+# what each consumer needs out of the replay archive. sc2reader's
+# load_level is cumulative, so reaching the tracker events also decodes the
+# message events and running the engine walks every event again; profiles
+# stop at the lowest level and read any further members by hand.
+@dataclass(frozen=True)
+class LoadProfile:
+    load_level: int
+    members: tuple = ()
+    players: bool = False
+    engine: bool = False
+
+# level 0 is the mpq header, level 1 is initData, details and attributes
+LOAD_PROFILES = {
+    'header': LoadProfile(load_level=0),
+    'details': LoadProfile(load_level=1),
+    'import': LoadProfile(load_level=1, players=True),
+    'stats': LoadProfile(
+        load_level=0,
+        members=('replay.tracker.events',)),
+    'import_stats': LoadProfile(
+        load_level=1,
+        members=('replay.tracker.events',),
+        players=True),
+    'full': LoadProfile(load_level=4, engine=True),
+}
+
+def _profile(profile):
+    return LOAD_PROFILES[profile] \
+        if isinstance(profile, str) \
+        else profile
+
+# reads whatever a profile needs past its load level into a replay that was
+# already loaded at that level, e.g. after a cheap details-only prefilter
+def finish_load(replay, profile):
+    profile = _profile(profile)
+    for member in profile.members:
+        replay._read_data(member, replay._get_reader(member))
+    if profile.players:
+        replay.load_players()
+    if 'replay.tracker.events' in profile.members:
+        replay.load_tracker_events()
+    return replay
+
+def load_replay(source, profile='full', **options):
+    profile = _profile(profile)
+    if profile.engine:
+        return sc2reader.load_replay(
+            source, load_level=profile.load_level, **options)
+    return finish_load(
+        sc2reader.load_replay(
+            source, load_level=profile.load_level, engine=None, **options),
+        profile)
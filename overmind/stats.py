@@ -1,9 +1,192 @@
 from sc2reader.resources import Replay
 from dataclasses import dataclass
+import warnings
+import numpy as np
+from overmind import timeseries
+from overmind.timeseries import (
+    player_stats_array, unit_events_array,
+    PLAYER_STATS_FIELD_INDEX, UNIT_EVENT_FIELD_INDEX,
+    PLAYER_STATS_DTYPE)
 
-# replace with type module
-from overmind.database import Race
+# game seconds, not real seconds
+FRAMES_PER_SECOND = 16
+MAX_SUPPLY = 200
 
-def players(replay : Replay):
-    replay.players
+@dataclass(frozen=True)
+class ReplaySeries:
+    pids: tuple
+    # (players, samples, PLAYER_STATS_FIELDS)
+    player_stats: np.ndarray
+    # (events, UNIT_EVENT_FIELDS)
+    unit_events: np.ndarray
 
+def replay_series(replay : Replay):
+    pids, player_stats = player_stats_array(replay.tracker_events)
+    return ReplaySeries(
+        pids=pids,
+        player_stats=player_stats,
+        unit_events=unit_events_array(replay.tracker_events))
+
+def replay_stats_series(replay_stats):
+    unit_events = timeseries.from_bytes(replay_stats.unit_events) \
+        if replay_stats.unit_events is not None \
+        else np.empty((0, len(UNIT_EVENT_FIELD_INDEX)), PLAYER_STATS_DTYPE)
+    return ReplaySeries(
+        pids=tuple(replay_stats.pids),
+        player_stats=timeseries.from_bytes(replay_stats.player_stats),
+        unit_events=unit_events)
+
+def _stack_player_stats(batch):
+    players = max((len(series.pids) for series in batch), default=0)
+    samples = max(
+        (series.player_stats.shape[1] for series in batch), default=0)
+    stats = np.full(
+        (len(batch), players, samples, len(PLAYER_STATS_FIELD_INDEX)),
+        np.nan,
+        dtype=PLAYER_STATS_DTYPE)
+    pids = np.zeros((len(batch), players), dtype=np.int64)
+    for i, series in enumerate(batch):
+        p, s, _ = series.player_stats.shape
+        stats[i, :p, :s] = series.player_stats
+        pids[i, :len(series.pids)] = series.pids
+    return pids, stats
+
+def _stack_unit_events(batch):
+    events = np.concatenate(
+        [ series.unit_events for series in batch ]
+        or [ np.empty((0, len(UNIT_EVENT_FIELD_INDEX))) ])
+    replays = np.repeat(
+        np.arange(len(batch)),
+        [ len(series.unit_events) for series in batch ])
+    return replays, events
+
+def _field(stats, *names):
+    return sum( stats[..., PLAYER_STATS_FIELD_INDEX[name]] for name in names )
+
+def _resource(stats, kind):
+    return _field(stats, *(
+        f'{resource}_{kind}_{category}'
+        for resource in ('minerals', 'vespene')
+        for category in ('army', 'economy', 'technology') ))
+
+# mean of every other player in the replay, the opponent in a 1v1
+def _opponent(values, present):
+    values = np.where(present, values, 0)
+    others = present.sum(axis=1, keepdims=True) - present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (values.sum(axis=1, keepdims=True) - values) / others
+
+def _ratio(a, b):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(b != 0, a / b, np.nan)
+
+def _supply_event_totals(pids, replays, events):
+    r, p = pids.shape
+    # (replay, pid) -> player slot, -1 for observers and the neutral player
+    lookup = np.full((r, max(int(pids.max(initial=0)), 16) + 1), -1)
+    rows, slots = np.nonzero(pids)
+    lookup[rows, pids[rows, slots]] = slots
+    column = lambda name: events[:, UNIT_EVENT_FIELD_INDEX[name]]
+    supply = column('supply')
+    kind = np.where(column('is_worker') > 0, 0, 1)
+    died = column('died') > 0
+    owner = lookup[replays, column('pid').astype(np.int64)]
+    killer = lookup[replays, column('killer_pid').astype(np.int64)]
+    # (replay, player, made/killed/lost, worker/army)
+    totals = np.zeros((r, p, 3, 2))
+    made = ~died & (owner >= 0)
+    np.add.at(
+        totals,
+        (replays[made], owner[made], 0, kind[made]),
+        supply[made])
+    killed = died & (killer >= 0) & (killer != owner)
+    np.add.at(
+        totals,
+        (replays[killed], killer[killed], 1, kind[killed]),
+        supply[killed])
+    lost = died & (owner >= 0)
+    np.add.at(
+        totals,
+        (replays[lost], owner[lost], 2, kind[lost]),
+        supply[lost])
+    return totals
+
+# columns of one row per player per replay, row order is replay then slot.
+# every metric is computed for the whole batch at once over a nan padded
+# (replays, players, samples, fields) array.
+def compute_metrics(batch):
+    pids, stats = _stack_player_stats(batch)
+    present = pids != 0
+    replays, events = _stack_unit_events(batch)
+    columns = dict()
+
+    def add(name, values):
+        columns[name] = values
+        columns[f'{name}_vs_opponent'] = values - _opponent(values, present)
+
+    with warnings.catch_warnings():
+        # padded players are all nan and get dropped below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        frame = _field(stats, 'frame')
+        food_used = _field(stats, 'food_used')
+        food_made = _field(stats, 'food_made')
+        collection = _field(
+            stats, 'minerals_collection_rate', 'vespene_collection_rate')
+        mean_collection = np.nanmean(collection, axis=2)
+
+        add('supply_max', np.nanmax(food_used, axis=2))
+        add('supply_mean', np.nanmean(food_used, axis=2))
+        add('supply_vs_available',
+            np.nanmean(_ratio(food_used, food_made), axis=2))
+
+        totals = _supply_event_totals(pids, replays, events)
+        for i, event in enumerate(('made', 'killed', 'lost')):
+            for j, kind in enumerate(('worker', 'army')):
+                add(f'{kind}_supply_{event}', totals[:, :, i, j])
+        add('worker_army_supply_ratio',
+            _ratio(totals[:, :, 0, 0], totals[:, :, 0, 1]))
+
+        # each sample stands for the frames until the next one
+        step = np.diff(frame, axis=2, append=np.nan)
+        step = np.where(np.isnan(step), 0, step)
+        blocked = (food_used >= food_made) & (food_made < MAX_SUPPLY)
+        add('time_supply_blocked',
+            (step * blocked).sum(axis=2) / FRAMES_PER_SECOND)
+        maxed = food_used >= MAX_SUPPLY - 1
+        columns['supply_maxed'] = maxed.any(axis=2)
+        columns['time_supply_maxed'] = np.where(
+            maxed.any(axis=2),
+            np.nanmin(np.where(maxed, frame, np.nan), axis=2),
+            np.nan) / FRAMES_PER_SECOND
+
+        for name, values in (
+                ('bank',
+                    _field(stats, 'minerals_current', 'vespene_current')),
+                ('collection_rate', collection),
+                ('resources_in_progress',
+                    _resource(stats, 'used_in_progress')),
+                ('resources_used', _resource(stats, 'used_current')),
+                ('resources_killed', _resource(stats, 'killed')),
+                ('resources_lost', _resource(stats, 'lost')),
+                ('tech_resources',
+                    _field(stats,
+                        'minerals_used_current_technology',
+                        'vespene_used_current_technology')), ):
+            add(f'{name}_max', np.nanmax(values, axis=2))
+            add(f'{name}_mean', np.nanmean(values, axis=2))
+            if name != 'collection_rate':
+                add(f'{name}_vs_collection_rate',
+                    _ratio(np.nanmean(values, axis=2), mean_collection))
+
+        columns['game_seconds'] = np.broadcast_to(
+            np.nanmax(frame, axis=(1, 2))[:, None],
+            pids.shape) / FRAMES_PER_SECOND
+
+    rows, slots = np.nonzero(present)
+    table = { 'replay': rows, 'pid': pids[rows, slots] }
+    table.update(
+        (name, values[rows, slots]) for name, values in columns.items() )
+    return table
+
+def replay_metrics(replays):
+    return compute_metrics([ replay_series(replay) for replay in replays ])
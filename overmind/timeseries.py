@@ -0,0 +1,152 @@
+from sc2reader.events.tracker import (
+    PlayerStatsEvent, UnitBornEvent, UnitDiedEvent, UnitInitEvent,
+    UnitDoneEvent, UnitTypeChangeEvent, UnitOwnerChangeEvent)
+from sc2reader.data import unit_lookup
+from io import BytesIO
+import numpy as np
+
+# one row per PlayerStatsEvent, one column per field, per player
+PLAYER_STATS_FIELDS = (
+    'frame',
+    'minerals_current',
+    'vespene_current',
+    'minerals_collection_rate',
+    'vespene_collection_rate',
+    'workers_active_count',
+    'food_used',
+    'food_made',
+    'minerals_used_in_progress_army',
+    'minerals_used_in_progress_economy',
+    'minerals_used_in_progress_technology',
+    'vespene_used_in_progress_army',
+    'vespene_used_in_progress_economy',
+    'vespene_used_in_progress_technology',
+    'minerals_used_current_army',
+    'minerals_used_current_economy',
+    'minerals_used_current_technology',
+    'vespene_used_current_army',
+    'vespene_used_current_economy',
+    'vespene_used_current_technology',
+    'minerals_lost_army',
+    'minerals_lost_economy',
+    'minerals_lost_technology',
+    'vespene_lost_army',
+    'vespene_lost_economy',
+    'vespene_lost_technology',
+    'minerals_killed_army',
+    'minerals_killed_economy',
+    'minerals_killed_technology',
+    'vespene_killed_army',
+    'vespene_killed_economy',
+    'vespene_killed_technology',
+)
+PLAYER_STATS_FIELD_INDEX = {
+    field: i for i, field in enumerate(PLAYER_STATS_FIELDS) }
+# float32 holds every resource count exactly and the half supply of zerglings
+PLAYER_STATS_DTYPE = np.float32
+
+def player_stats_rows(tracker_events):
+    rows = dict()
+    for event in tracker_events:
+        if not isinstance(event, PlayerStatsEvent):
+            continue
+        rows.setdefault(event.pid, list()).append(tuple(
+            getattr(event, field) for field in PLAYER_STATS_FIELDS ))
+    return rows
+
+# (pids, array) where array is (players, samples, fields). players that
+# report fewer samples are padded with nan.
+def player_stats_array(tracker_events):
+    rows = player_stats_rows(tracker_events)
+    pids = tuple(sorted(rows))
+    samples = max(map(len, rows.values()), default=0)
+    array = np.full(
+        (len(pids), samples, len(PLAYER_STATS_FIELDS)),
+        np.nan,
+        dtype=PLAYER_STATS_DTYPE)
+    for i, pid in enumerate(pids):
+        array[i, :len(rows[pid])] = rows[pid]
+    return pids, array
+
+def field(array, name):
+    return array[..., PLAYER_STATS_FIELD_INDEX[name]]
+
+# one row per worker or army unit made or lost
+UNIT_EVENT_FIELDS = (
+    'frame',
+    'pid',
+    'killer_pid',
+    'died',
+    'supply',
+    'is_worker',
+    'is_army',
+)
+UNIT_EVENT_FIELD_INDEX = {
+    field: i for i, field in enumerate(UNIT_EVENT_FIELDS) }
+
+_unit_info = {
+    name: (
+        info.get('supply', 0),
+        info.get('is_worker', False),
+        info.get('is_army', False))
+    for units in unit_lookup.values()
+    for name, info in units.items() }
+_no_unit_info = (0, False, False)
+
+def unit_info(unit_type_name):
+    return _unit_info.get(unit_type_name.lower(), _no_unit_info)
+
+def _is_counted(info):
+    return info[1] or info[2]
+
+# units are made when born, when they finish after an init (warp-ins,
+# buildings, some morphs) or when they morph out of larva, eggs and
+# cocoons. a unit that dies before it finishes was never made, so it isn't
+# lost either.
+def unit_events_array(tracker_events):
+    units = dict()
+    rows = list()
+    for event in tracker_events:
+        if isinstance(event, (UnitBornEvent, UnitInitEvent)):
+            info = unit_info(event.unit_type_name)
+            done = isinstance(event, UnitBornEvent)
+            units[event.unit_id] = [ event.control_pid, info, done ]
+            if done and _is_counted(info):
+                rows.append((event.frame, event.control_pid, 0, 0, *info))
+        elif isinstance(event, UnitDoneEvent):
+            unit = units.get(event.unit_id)
+            if not unit or unit[2]:
+                continue
+            unit[2] = True
+            if _is_counted(unit[1]):
+                rows.append((event.frame, unit[0], 0, 0, *unit[1]))
+        elif isinstance(event, UnitTypeChangeEvent):
+            unit = units.get(event.unit_id)
+            if not unit:
+                continue
+            info = unit_info(event.unit_type_name)
+            # larva, eggs and cocoons turning into the units they were making
+            if unit[2] and _is_counted(info) and not _is_counted(unit[1]):
+                rows.append((event.frame, unit[0], 0, 0, *info))
+            unit[1] = info
+        elif isinstance(event, UnitOwnerChangeEvent):
+            if event.unit_id in units:
+                units[event.unit_id][0] = event.control_pid
+        elif isinstance(event, UnitDiedEvent):
+            unit = units.pop(event.unit_id, None)
+            if unit and unit[2] and _is_counted(unit[1]):
+                rows.append((
+                    event.frame, unit[0], event.killer_pid or 0, 1, *unit[1]))
+    return np.array(rows, dtype=PLAYER_STATS_DTYPE) \
+        .reshape(len(rows), len(UNIT_EVENT_FIELDS))
+
+def unit_field(array, name):
+    return array[..., UNIT_EVENT_FIELD_INDEX[name]]
+
+def to_bytes(array):
+    buffer = BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+def from_bytes(data):
+    return np.load(BytesIO(bytes(data)), allow_pickle=False)
@@ -7,5 +7,5 @@ setup(
    author='Doug Ives',
    author_email='github@dou.gives',
    packages=[ 'overmind' ],
-   install_requires=[ 'sc2reader', 'python-dotenv' ],
+   install_requires=[ 'sc2reader', 'python-dotenv', 'aiohttp', 'numpy' ],
 )